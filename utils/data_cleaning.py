@@ -3,8 +3,15 @@ import numpy as np
 import glob
 import matplotlib.pyplot as plt
 import os
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
 
-def read_concat_file(file_with_path, sep = ","):
+# the pyarrow csv reader is used if installed and asked for (engine = 'pyarrow'), otherwise the pandas C reader
+PYARROW_AVAILABLE = find_spec('pyarrow') is not None
+
+def read_concat_file(file_with_path, sep = ",", usecols = None, dtype = None, engine = None, n_jobs = None):
     """
     Read in all files starting with "file" string ending in ".csv" or ".txt", concatenate and return as pandas dataframe.
 
@@ -15,6 +22,20 @@ def read_concat_file(file_with_path, sep = ","):
         
         sep : string (default = ",")
             string separating columns in data
+
+        usecols : list (default = None)
+            names (or positions for a single .txt file without header) of the columns to read, all columns if None
+
+        dtype : dict (default = None)
+            type of columns (e.g. {'Adj Close': np.float64}), inferred if not given
+
+        engine : {'c', 'pyarrow', None} (default = None)
+            csv reader of pandas, 'pyarrow' (multithreaded, parses ISO dates while reading) falls back to the C reader if
+            pyarrow is not installed
+
+        n_jobs : int (default = None)
+            number of threads reading the files concurrently if more files are found (None: as many as concurrent.futures
+            chooses)
     
     Returns
     --------------------------------------
@@ -31,25 +52,27 @@ def read_concat_file(file_with_path, sep = ","):
         #extension
         type = os.path.splitext(files[0])[1]
 
+        if engine == 'pyarrow' and not PYARROW_AVAILABLE:
+            engine = 'c'
+        options = dict(sep=sep, encoding='latin1', usecols=usecols, dtype=dtype, engine=engine)
+
         if(type == ".csv"):
          ## CSV
             if len(files) > 1:
              ## if more files
-                df = pd.concat([pd.read_csv(f, encoding='latin1')
-                            for f in glob.glob(file_with_path + '*.csv')], ignore_index=True)
+                df = pd.concat(_read_files(glob.glob(file_with_path + '*.csv'), options, n_jobs), ignore_index=True)
             else:
              ## if one file
-                df = pd.read_csv(files[0],encoding='latin1')
+                df = pd.read_csv(files[0], **options)
             return(df)
         elif(type == ".txt"):
          ## TXT
             if len(files) > 1:
               ## if more files
-                df = pd.concat([pd.read_csv(f, encoding='latin1')
-                               for f in glob.glob(file_with_path + '*.txt')], ignore_index=True)
+                df = pd.concat(_read_files(glob.glob(file_with_path + '*.txt'), options, n_jobs), ignore_index=True)
             else:
               ## if one file
-                df = pd.read_csv(files[0], encoding='latin1', header=None)
+                df = pd.read_csv(files[0], header=None, **options)
             return(df)
         else:
             raise Exception("Could not recognize type.")
@@ -57,7 +80,13 @@ def read_concat_file(file_with_path, sep = ","):
         raise Exception("No files with the given name.")
 
 
-def univar_ts (data, varname, datename):
+def _read_files(files, options, n_jobs=None):
+    """pd.read_csv of each file (in the order of files), run in a thread pool."""
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return(list(executor.map(lambda f: pd.read_csv(f, **options), files)))
+
+
+def univar_ts (data, varname, datename, date_format = None):
     """ 
     Turns a pandas dataset to a univariate time series if the variable name and date index is given by their column name.
 
@@ -71,16 +100,17 @@ def univar_ts (data, varname, datename):
         
         dataname : string
             name of column to be used as index for time series - must be datetime
+
+        date_format : string (default = None)
+            format of the dates (e.g. '%Y-%m-%d'), parsing with a given format is faster than inferring it
     
     Returns
     ------------------------------
         data : pandas.Series
             pandas timeseries object (univariate)
     """
-    data_new = data.copy()
-    data_new = data_new[[varname, datename]]
-    data_new.set_index(pd.to_datetime(data_new[datename]), inplace=True)
-    data_new = data_new[[varname]]
+    # only the variable is copied, the dates become the index
+    data_new = data[[varname]].set_index(pd.to_datetime(data[datename], format=date_format))
     return(data_new)
 
 def spec_sample(data, freq, length = None):
@@ -122,7 +152,8 @@ def spec_sample(data, freq, length = None):
         raise Exception('Error.')
 
 
-def create_cleaned_set(file_with_path, varname, datename, freq=None, datetime_last=None, length=None, weekdays=False, fill_na_method = None):
+def create_cleaned_set(file_with_path, varname, datename, freq=None, datetime_last=None, length=None, weekdays=False, fill_na_method = None,
+                       date_format=None, engine=None, n_jobs=None, cache_dir=None):
     """Run all chosen transformations on the data.
     
     Parameters
@@ -159,6 +190,17 @@ def create_cleaned_set(file_with_path, varname, datename, freq=None, datetime_la
         
         fill_na_method: {‘backfill’, ‘bfill’, ‘pad’, ‘ffill’, None}, default None
             Method to use for filling holes in reindexed Series pad / ffill: propagate last valid observation forward to next valid backfill / bfill: use NEXT valid observation to fill gap
+
+        date_format : string (default = None)
+            format of the dates (e.g. '%Y-%m-%d'), inferred if not given
+
+        engine, n_jobs : (default = None)
+            csv reader and number of threads reading the files, as in read_concat_file
+
+        cache_dir : string (default = None)
+            directory of a cache of cleaned series (created if needed): the result is saved there as .npy files and
+            loaded memory-mapped by the next calls with the same file and parameters, until one of the files found on
+            the path changes (modification time or size) or files are added or removed
    
     Returns
     -------------------------------------
@@ -169,11 +211,20 @@ def create_cleaned_set(file_with_path, varname, datename, freq=None, datetime_la
             number of missing instances (if any)
     """
     
-    # read in data (concatenate multiple files if necessary)
-    df = read_concat_file(file_with_path)
+    # cached result
+    if cache_dir != None:
+        key = _cache_key(os.path.abspath(file_with_path), varname, datename, freq, datetime_last, length, weekdays,
+                         fill_na_method, date_format)
+        sources = _source_files(file_with_path)
+        cached = _load_cached_set(cache_dir, key, sources)
+        if cached is not None:
+            return(cached)
+
+    # read in data (concatenate multiple files if necessary), only the date and the variable (as float)
+    df = read_concat_file(file_with_path, usecols=[datename, varname], dtype={varname: np.float64}, engine=engine, n_jobs=n_jobs)
 
     # turn into ts
-    df = univar_ts(df, varname, datename)
+    df = univar_ts(df, varname, datename, date_format)
 
     # change frequency if required
     if freq != None:
@@ -204,8 +255,183 @@ def create_cleaned_set(file_with_path, varname, datename, freq=None, datetime_la
         if fill_na_method != None:
             df = df.fillna(method=fill_na_method)
 
+    if cache_dir != None:
+        _store_cached_set(cache_dir, key, sources, df, num_missing)
     return(df, num_missing)
 
+
+def create_cleaned_panel(path, varname, datename, datetime_last=None, fill_na_method='ffill', date_format=None,
+                         engine=None, n_jobs=None, cache_dir=None):
+    """Cleaned daily series of all data files of a directory (or matching a glob pattern, e.g. '../data/data_raw/*/*.csv'),
+    aligned on one business-day calendar, as one (time x assets) array.
+    Each asset is reindexed on the business days from its first to its last date and filled as with weekdays = True
+    in create_cleaned_set, so the rows of an asset in the panel are the values of create_cleaned_set; the rows outside
+    its period are missing (nan). The files are read concurrently (in threads).
+
+    Parameters
+    -------
+        path : string
+            directory of the data files (.csv or .txt) or glob pattern of the files
+        
+        varname, datename : string
+            name of the column of the variable and of the date-time in all files
+        
+        datetime_last : (default = None)
+            date of the last data point if data should be downsized
+        
+        fill_na_method: {'backfill', 'bfill', 'pad', 'ffill', None}, default 'ffill'
+            method to use for filling the missing business days of each asset (within its period), as in create_cleaned_set
+        
+        date_format, engine, cache_dir :
+            same as in create_cleaned_set (one cache entry per file)
+        
+        n_jobs : int (default = None)
+            number of threads reading the files (None: as many as concurrent.futures chooses)
+
+    Returns
+    -------------------------------------
+        panel : np.array (float64) of shape (n_dates, n_assets)
+            values of the assets (C order, use panel.T for functions taking one series per row, e.g. competing_signals
+            or batch_financial_evaluation)
+        
+        index : pd.DatetimeIndex
+            business days from the first to the last date of all assets
+        
+        names : list of strings
+            name of each asset (file name without extension)
+        
+        first_valid, end_valid : np.array (int)
+            row of the first value and row after the last value of each asset (panel[first_valid[i]:end_valid[i], i]
+            are its values, which can still have missing ones with fill_na_method = None)
+        
+        num_missing : np.array (int)
+            number of missing values of each asset in its period before filling
+    """
+    if os.path.isdir(path):
+        files = sorted(f for f in glob.glob(os.path.join(path, '*')) if os.path.splitext(f)[1] in ('.csv', '.txt'))
+    else:
+        files = sorted(glob.glob(path))
+    if len(files) == 0:
+        raise Exception("No files with the given name.")
+    names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+
+    # series of each asset as read, the calendar alignment is done for all assets together
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        series = list(executor.map(lambda f: create_cleaned_set(f, varname, datename, datetime_last=datetime_last,
+                                                                  date_format=date_format, engine=engine, n_jobs=1,
+                                                                  cache_dir=cache_dir)[0], files))
+    for name, df in zip(names, series):
+        if len(df) == 0:
+            raise Exception('No data for ' + name + '.')
+        if not df.index.is_unique:
+            raise Exception('The dates of ' + name + ' should be unique.')
+
+    # business days from the first to the last date (numpy calendar, much faster than pd.date_range with freq='B')
+    days = np.arange(np.datetime64(min(df.index[0] for df in series).date()),
+                     np.datetime64(max(df.index[-1] for df in series).date()) + 1)
+    index = pd.DatetimeIndex(days[np.is_busday(days)].astype('datetime64[ns]'), freq='B')
+    panel = np.full((len(index), len(series)), np.nan)
+
+    # period of each asset on the calendar: the business days from its first to its last date
+    first = index.searchsorted([df.index[0] for df in series])
+    end = index.searchsorted([df.index[-1] for df in series], side='right')
+    for i, df in enumerate(series):
+        rows = index.get_indexer(df.index)
+        on_calendar = rows >= 0
+        panel[rows[on_calendar], i] = df.to_numpy(dtype=np.float64)[on_calendar, 0]
+
+    rows = np.arange(len(index))[:, np.newaxis]
+    in_period = (rows >= first) & (rows < end)
+    num_missing = np.sum(np.isnan(panel) & in_period, axis=0)
+
+    # fill along time (the rows outside the periods are all missing, so nothing is carried into another period)
+    if fill_na_method in ('pad', 'ffill', 'backfill', 'bfill'):
+        forward = fill_na_method in ('pad', 'ffill')
+        values = panel if forward else panel[::-1]
+        last_value = np.maximum.accumulate(np.where(np.isnan(values), 0, rows), axis=0)
+        values = values[last_value, np.arange(len(series))]
+        panel = np.ascontiguousarray(np.where(in_period, values if forward else values[::-1], np.nan))
+    elif fill_na_method != None:
+        raise Exception('Unknown fill_na_method ' + str(fill_na_method) + ', please choose from backfill, bfill, pad, ffill or None.')
+
+    valid = ~np.isnan(panel)
+    has_values = valid.any(axis=0)
+    first_valid = np.where(has_values, np.argmax(valid, axis=0), end)
+    end_valid = np.where(has_values, len(index) - np.argmax(valid[::-1], axis=0), end)
+    return(panel, index, names, first_valid, end_valid, num_missing)
+
+
+## Cache
+def _cache_key(*parts):
+    """Hash of the given parts (strings, numbers, tuples), used as entry name."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def _source_files(file_with_path):
+    """Path, modification time (ns) and size of each file found on the path."""
+    files = sorted(os.path.abspath(f) for f in glob.glob(file_with_path + '*'))
+    return [[f, os.stat(f).st_mtime_ns, os.stat(f).st_size] for f in files]
+
+
+def _load_cached_set(cache_dir, key, sources):
+    """Cached (df, num_missing) with the values and dates memory-mapped, None if missing or if the files changed.
+    The values are mapped copy-on-write, so df is writable like an uncached result and writes never reach the cache."""
+    meta_path = os.path.join(cache_dir, key + '.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta['sources'] != sources:
+        return None
+
+    values = np.load(os.path.join(cache_dir, key + '.npy'), mmap_mode='c')
+    dates = np.load(os.path.join(cache_dir, key + '_index.npy'), mmap_mode='r')
+    index = pd.DatetimeIndex(dates, freq=meta['freq'], name=meta['index_name'])
+    df = pd.DataFrame(values, index=index, columns=[meta['column']], copy=False)
+    num_missing = pd.Series(np.asarray(meta['num_missing'], dtype=np.int64), index=df.columns)
+    return(df, num_missing)
+
+
+def _store_cached_set(cache_dir, key, sources, df, num_missing):
+    """Save df (one float column with a time zone naive DatetimeIndex, otherwise not cached) and num_missing.
+    The column label and the index name must be strings or integers (positions of a .txt file without header),
+    so that they are the same when loaded back, otherwise the result is not cached.
+    The files are written under temporary names and renamed, the metadata last, so that other processes reading the
+    cache at the same time never load a partly written entry."""
+    if (not isinstance(df.index, pd.DatetimeIndex)) or (df.index.tz is not None) or (df.shape[1] != 1):
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # metadata first (nothing is cached if it can not be written)
+    tmp = '.' + str(os.getpid()) + '.tmp'
+    meta_path = os.path.join(cache_dir, key + '.json')
+    try:
+        meta = {'sources': sources, 'column': _json_label(df.columns[0]), 'index_name': _json_label(df.index.name),
+                'freq': df.index.freqstr, 'num_missing': [int(n) for n in num_missing]}
+        with open(meta_path + tmp, 'w') as f:
+            json.dump(meta, f)
+    except (TypeError, ValueError, OSError):
+        if os.path.exists(meta_path + tmp):
+            os.remove(meta_path + tmp)
+        return
+
+    arrays = {key + '.npy': np.ascontiguousarray(df.to_numpy(dtype=np.float64)),
+              key + '_index.npy': np.ascontiguousarray(df.index.to_numpy())}
+    for name, array in arrays.items():
+        with open(os.path.join(cache_dir, name + tmp), 'wb') as f:
+            np.save(f, array)
+        os.replace(os.path.join(cache_dir, name + tmp), os.path.join(cache_dir, name))
+    os.replace(meta_path + tmp, meta_path)
+
+
+def _json_label(label):
+    """Column label or index name as a JSON value that loads back equal (str, int or None), TypeError for other labels."""
+    if (label is None) or isinstance(label, str):
+        return label
+    if isinstance(label, (int, np.integer)) and not isinstance(label, (bool, np.bool_)):
+        return int(label)
+    raise TypeError('Label ' + repr(label) + ' can not be cached.')
+
 ## Report
 def report():
  ## read data
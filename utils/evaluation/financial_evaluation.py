@@ -4,6 +4,9 @@ import glob
 import matplotlib.pyplot as plt
 import os
 
+# integer signals are the label codes of labels.trading_strategies (other codes, e.g. NO_LABEL = -1, are not a signal)
+SIGNAL_CODES = {"Sell": 0, "Buy": 1, "Hold": 2}
+
 
 def financial_evaluation(varname, prices, signals, initial_capital = 10000.0, trading_commission= 5.0, safety = False):
     """ 
@@ -20,6 +23,7 @@ def financial_evaluation(varname, prices, signals, initial_capital = 10000.0, tr
         
         signals : np.array or pd.Series (string array of ["Buy", "Sell", "Hold"])
             array or series of trading signals, directly mapped to the prices
+            (or integer codes: Sell = 0, Buy = 1, Hold = 2, e.g. from labels.competing_strategies)
 
         initial_capital : np.float (default = 10000.0)
             amount of initial investment (capital)
@@ -32,7 +36,7 @@ def financial_evaluation(varname, prices, signals, initial_capital = 10000.0, tr
     
     Returns
     ------------------------------
-        capital : list of floats
+        capital : np.array (float64)
             amount of capital initially, and at every time step
 
         cumulative_return : np.float
@@ -77,191 +81,16 @@ def financial_evaluation(varname, prices, signals, initial_capital = 10000.0, tr
     """
     if len(prices) != len(signals):
         raise Exception("Please provide the same number of signals and prices.")
-    # list to track owned capital
-    capital = []
-    # initial capital
-    capital.append(initial_capital)
-
-    # list to track number of units in possession at each time step
-    num_units = []
-    # initial
-    num_units.append(0)
-
-    # list to track amount of cash owned
-    money = []
-    # initial cash
-    money.append(initial_capital)
-
-
 
-    # list to track number of profiting trades
-    winners = 0
-    # list to track number of losing trades
-    losers = 0
+    capital, trades, is_buy, total_transaction_cost = backtest(prices, signals, initial_capital, trading_commission, safety)
 
     # variables to track number of executed trades
-    buys = 0
-    sells = 0
-
-    # track transaction costs
-    total_transaction_cost = 0
-
-    # no safety
-    if safety == False:
-        for idx, order in enumerate(signals):
-            if order == "Buy":
-                ## given there is cash to spend
-                if money[-1] != 0:
-                    ## amount of units bought, trading fee
-                    num_units.append((money[-1]-trading_commission)/prices[idx])
-                    total_transaction_cost += trading_commission
-
-                    ## increase number of executed buy orders
-                    buys += 1
-
-                    ## update money
-                    money.append(0)
-
-                    ## tracking capital
-                    capital.append(prices[idx] * num_units[-1])
-
-                    if capital[-1] > capital[-2]:
-                        winners += 1
-                    elif capital[-1] < capital [-2]:
-                        losers +=1
-                else:
-                    ## HOLD
-                    ## still tracking
-                    num_units.append(num_units[-1])
-                    money.append(money[-1])
-
-                    ## tracking capital
-                    capital.append(prices[idx] * num_units[-1])
-
-            elif order == "Sell":
-                ## given there are units of the asset to sell
-                if num_units[-1] != 0:
-                    ## amount of money received for sold units, trading fee
-                    money.append(num_units[-1] * prices[idx] - trading_commission)
-                    total_transaction_cost += trading_commission
-
-                    ## increase number of executed sell orders
-                    sells += 1
-
-                    ## update number of units
-                    num_units.append(0)
-
-                    ## tracking capital
-                    capital.append(money[-1])
-
-                    ## check if we won or lost with the trade
-                    if capital[-1] > capital[-2]:
-                        winners += 1
-                    elif capital[-1] < capital[-2]:
-                        losers += 1
-
-                else:
-                    ## HOLD
-                    ## still tracking
-                    num_units.append(num_units[-1])
-                    money.append(money[-1])
-
-                    ## tracking capital
-                    capital.append(money[-1])
-
-            elif order == "Hold":
-                ## still tracking 
-                num_units.append(num_units[-1])
-                money.append(money[-1])
-
-                ## tracking capital too
-                if money[-1] != 0:
-                    capital.append(money[-1])
-                else:
-                    capital.append(prices[idx] * num_units[-1])
-    else:
-        for idx, order in enumerate(signals):
-
-            if idx == 0:
-                greater = False
-                smaller = False
-            else:
-                greater = prices[idx] > prices[idx-1]
-                smaller = prices[idx] < prices[idx-1]
-
-            if (order == "Buy") & (greater == False):
-                ## given there is cash to spend
-                if money[-1] != 0:
-                    ## amount of units bought, trading fee
-                    num_units.append(
-                        (money[-1]-trading_commission)/prices[idx])
-                    total_transaction_cost += trading_commission
-
-                    ## increase number of executed buy orders
-                    buys += 1
-
-                    ## update money
-                    money.append(0)
-
-                    ## tracking capital
-                    capital.append(prices[idx] * num_units[-1])
-
-                    if capital[-1] > capital[-2]:
-                        winners += 1
-                    elif capital[-1] < capital[-2]:
-                        losers += 1
-                else:
-                    ## HOLD
-                    ## still tracking
-                    num_units.append(num_units[-1])
-                    money.append(money[-1])
-
-                    ## tracking capital
-                    capital.append(prices[idx] * num_units[-1])
-
-            elif (order == "Sell") & (smaller == False):
-                ## given there are units of the asset to sell
-                if num_units[-1] != 0:
-                    ## amount of money received for sold units, trading fee
-                    money.append(num_units[-1] *
-                                 prices[idx] - trading_commission)
-                    total_transaction_cost += trading_commission
-
-                    ## increase number of executed sell orders
-                    sells += 1
-
-                    ## update number of units
-                    num_units.append(0)
-
-                    ## tracking capital
-                    capital.append(money[-1])
-
-                    ## check if we won or lost with the trade
-                    if capital[-1] > capital[-2]:
-                        winners += 1
-                    elif capital[-1] < capital[-2]:
-                        losers += 1
-
-                else:
-                    ## HOLD
-                    ## still tracking
-                    num_units.append(num_units[-1])
-                    money.append(money[-1])
-
-                    ## tracking capital
-                    capital.append(money[-1])
-
-            else:
-                ## still tracking
-                num_units.append(num_units[-1])
-                money.append(money[-1])
-
-                ## tracking capital too
-                if money[-1] != 0:
-                    capital.append(money[-1])
-                else:
-                    capital.append(prices[idx] * num_units[-1])
+    buys = int(np.count_nonzero(is_buy))
+    sells = len(trades) - buys
 
+    # check if we won or lost with each trade (capital after the trade compared to the one before)
+    winners = int(np.count_nonzero(capital[trades + 1] > capital[trades]))
+    losers = int(np.count_nonzero(capital[trades + 1] < capital[trades]))
 
     ending_capital = capital[-1]
     total_profit = ending_capital - initial_capital
@@ -304,6 +133,353 @@ def financial_evaluation(varname, prices, signals, initial_capital = 10000.0, tr
     }
     return to_return
 
+
+def backtest(prices, signals, initial_capital=10000.0, trading_commission=5.0, safety=False):
+    """Capital curve and executed trades of financial_evaluation, computed with array operations.
+    All the capital goes into the asset at an executed buy and all the units are sold at an executed sell, so the
+    position alternates between cash and the asset: the executed trades are the first buy (or sell) of each run of
+    buys (or sells), leading sells (nothing to sell) left out. Only the cash / units after each executed trade are
+    computed in a loop (a trade depends on the previous one), the holdings of every time step are then carried forward
+    from the last trade. Without safety, signals other than Buy, Sell and Hold are skipped (they have no time step in
+    capital); with safety they are held, as are buys at a price higher than the previous one and sells at a lower one.
+
+    Parameters
+    -------------------------------
+        prices, signals, initial_capital, trading_commission, safety :
+            same as in financial_evaluation
+
+    Returns
+    ------------------------------
+        capital : np.array (float64)
+            amount of capital initially, and at every time step
+
+        trades : np.array (int)
+            time step of each executed trade (capital[trades + 1] is the capital after the trade)
+
+        is_buy : np.array (bool)
+            whether each executed trade is a buy (otherwise a sell)
+
+        total_transaction_cost : float
+            total amount spent on transaction fees
+    """
+    prices, sell, trades, is_buy = signal_orders(prices, signals, safety)
+    money, units = execute_trades(prices[trades], is_buy, initial_capital, trading_commission)
+    n_executed = len(money) - 1
+    trades, is_buy = trades[:n_executed], is_buy[:n_executed]
+
+    # holdings at each time step, from the last executed trade up to it
+    state = np.zeros(len(prices), dtype=np.int64)
+    state[trades] = 1
+    state = np.cumsum(state)
+
+    capital = np.empty(len(prices) + 1)
+    capital[0] = initial_capital
+    capital[1:] = _capital_at(prices, sell, np.asarray(money, dtype=np.float64)[state], np.asarray(units, dtype=np.float64)[state])
+
+    return(capital, trades, is_buy, _transaction_cost(n_executed, trading_commission))
+
+
+def signal_orders(prices, signals, safety=False):
+    """Time steps and candidate trades of a signal series (the part of backtest not depending on the capital and
+    the commission).
+
+    Returns
+    ------------------------------
+        prices : np.array (float64)
+            prices of the time steps (without the skipped signals)
+
+        sell : np.array (bool)
+            whether a sell order is placed at each time step
+
+        trades : np.array (int)
+            time step of each candidate trade, the first buy / sell of each run of buys / sells
+
+        is_buy : np.array (bool)
+            whether each candidate trade is a buy
+    """
+    prices = np.asarray(prices, dtype=np.float64).reshape(-1)
+    signals = np.asarray(signals).reshape(-1)
+
+    if np.issubdtype(signals.dtype, np.integer):
+        buy, sell, hold = [signals == SIGNAL_CODES[name] for name in ("Buy", "Sell", "Hold")]
+    else:
+        buy, sell, hold = (signals == "Buy"), (signals == "Sell"), (signals == "Hold")
+
+    if safety == False:
+        # other signals do not count as a time step
+        known = buy | sell | hold
+        if not known.all():
+            prices, buy, sell = prices[known], buy[known], sell[known]
+    else:
+        # only Buy if price is not higher than the previous one, only Sell if it is not lower
+        greater = np.concatenate(([False], prices[1:] > prices[:-1]))
+        smaller = np.concatenate(([False], prices[1:] < prices[:-1]))
+        buy = buy & ~greater
+        sell = sell & ~smaller
+
+    # candidate trades: first signal of each run of buys / sells, a sell first has nothing to sell
+    orders = np.flatnonzero(buy | sell)
+    order_is_buy = buy[orders]
+    first_of_run = order_is_buy != np.concatenate(([False], order_is_buy[:-1]))
+    return(prices, sell, orders[first_of_run], order_is_buy[first_of_run])
+
+
+def execute_trades(trade_prices, is_buy, initial_capital, trading_commission):
+    """Cash and units initially and after each executed trade (as lists), exactly as trading one order after the other.
+    The trades stop being executed when a trade leaves neither cash nor units."""
+    # (Python floats give the same results as numpy scalars, except for a zero price: inf units with numpy)
+    trade_prices = np.asarray(trade_prices)
+    trade_prices = trade_prices.tolist() if trade_prices.all() else trade_prices
+    money, units = [initial_capital], [0]
+    cash, held = initial_capital, 0
+    for price, trade_is_buy in zip(trade_prices, np.asarray(is_buy).tolist()):
+        # a buy needs cash to spend, a sell units to sell
+        if (cash == 0) and (held == 0):
+            break
+        if trade_is_buy:
+            held, cash = (cash - trading_commission)/price, 0
+        else:
+            cash, held = held * price - trading_commission, 0
+        money.append(cash)
+        units.append(held)
+    return(money, units)
+
+
+def execute_trades_grid(trade_prices, is_buy, initial_capital, trading_commission, n_trades=None):
+    """execute_trades for many combinations (columns) at once, e.g. every series, initial capital and trading
+    commission: the cash and units of all the columns are vectors updated trade by trade.
+
+    Parameters
+    -------------------------------
+        trade_prices, is_buy : np.array of shape (n_trades, n_columns)
+            price and direction of the candidate trades of each column (see signal_orders), padded at the end
+
+        initial_capital, trading_commission : np.array (float64) of shape (n_columns,)
+            initial capital and trading commission of each column
+
+        n_trades : np.array (int) of shape (n_columns,) (default = None)
+            number of candidate trades of each column (the rest is padding), all rows if not defined
+
+    Returns
+    ------------------------------
+        money, units : np.array (float64) of shape (n_trades + 1, n_columns)
+            cash and units initially and after each trade, as execute_trades (unchanged after the last executed trade)
+
+        n_executed : np.array (int) of shape (n_columns,)
+            number of executed trades of each column
+    """
+    trade_prices = np.asarray(trade_prices, dtype=np.float64)
+    is_buy = np.asarray(is_buy, dtype=bool)
+    n_rows, n_columns = trade_prices.shape
+    n_trades = np.full(n_columns, n_rows) if n_trades is None else np.asarray(n_trades)
+
+    money = np.empty((n_rows + 1, n_columns))
+    units = np.empty((n_rows + 1, n_columns))
+    money[0], units[0] = initial_capital, 0.
+    n_executed = np.zeros(n_columns, dtype=np.int64)
+
+    active = np.ones(n_columns, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(n_rows):
+            cash, held = money[k], units[k]
+            # a buy needs cash to spend, a sell units to sell (a column stops at the first trade with neither)
+            active &= (cash != 0) | (held != 0)
+            trading = active & (k < n_trades)
+            buy = trading & is_buy[k]
+            sell = trading & ~is_buy[k]
+            units[k + 1] = np.where(buy, (cash - trading_commission)/trade_prices[k], np.where(sell, 0., held))
+            money[k + 1] = np.where(sell, held * trade_prices[k] - trading_commission, np.where(buy, 0., cash))
+            n_executed += trading
+    return(money, units, n_executed)
+
+
+def _capital_at(prices, sell, money, units):
+    """Capital at time steps holding money and units: the cash when there is some (or after a sell), otherwise the
+    value of the units."""
+    return(np.where(sell | (money != 0), money, prices * units))
+
+
+def _transaction_cost(n_executed, trading_commission):
+    """Total of the fees of n_executed trades (summed one trade after the other)."""
+    return(np.cumsum(np.full(n_executed, trading_commission, dtype=np.float64))[-1] if n_executed > 0 else 0)
+
+
+def _annualized_return(growth, n_steps):
+    """Annualized return of each capital growth over n_steps time steps (nan without time steps).
+    (Scalar powers: the array power can differ from financial_evaluation in the last digit.)"""
+    return(np.array([growth_i**(260/n_i) - 1 if n_i > 0 else np.nan for growth_i, n_i in zip(growth, n_steps.tolist())],
+                    dtype=np.float64))
+
+
+def batch_financial_evaluation(prices, signals,
+                               varnames=None,
+                               lengths=None,
+                               initial_capital=(10000.0,),
+                               trading_commission=(5.0,),
+                               safety=(False,),
+                               chunk_elements=2**22):
+    """financial_evaluation of many signal series (e.g. every asset, strategy and test period) over a grid of
+    initial capitals, trading commissions and safety settings in one call, returned as one table.
+    The orders of each series are derived once per safety setting and shared by all capitals and commissions,
+    which only need the executed trades (no pass over all the time steps). The trades of all the combinations are
+    then executed together (execute_trades_grid, one vector operation per trade over every series and grid value)
+    and the measurements are computed as arrays.
+
+    Parameters
+    -------------------------------
+        prices : np.array of shape (n_series, n_steps), or (n_steps,) for the same prices for every series
+            prices of each series
+
+        signals : np.array of shape (n_series, n_steps) (strings "Buy", "Sell", "Hold", or integer codes)
+            trading signals of each series, directly mapped to the prices
+
+        varnames : list of str or pd.DataFrame (default = None)
+            name of each series, or a DataFrame with one row per series (e.g. asset, strategy and period columns)
+            whose columns are copied to the results; the row number of the series if not defined
+
+        lengths : list of int (default = None)
+            number of time steps of each series (series shorter than n_steps padded at the end), all steps if not defined
+
+        initial_capital, trading_commission, safety : list or single value (default = [10000.0], [5.0], [False])
+            values to evaluate every series with (all combinations)
+
+        chunk_elements : int (default = 2**22)
+            bound on the number of (trade, combination) values executed together (bounds the memory used)
+
+    Returns
+    ------------------------------
+        results : pd.DataFrame
+            one row per series and combination of initial_capital, trading_commission and safety, with the
+            measurements of financial_evaluation (except capital) as columns; measurements financial_evaluation
+            would divide by zero for (e.g. success_ratio without trades) are nan, as are the avg_trade_profit /
+            avg_trade_loss it gives as None
+    """
+    signals = np.asarray(signals)
+    if signals.ndim == 1:
+        signals = signals[np.newaxis]
+    prices = np.asarray(prices, dtype=np.float64)
+    prices = np.broadcast_to(prices, signals.shape) if prices.ndim == 1 else prices
+    if prices.shape != signals.shape:
+        raise Exception("Please provide the same number of signals and prices.")
+
+    n_series = len(signals)
+    lengths = np.full(n_series, signals.shape[1]) if lengths is None else np.asarray(lengths)
+    if isinstance(varnames, pd.DataFrame):
+        descriptions = varnames.reset_index(drop=True)
+    else:
+        descriptions = pd.DataFrame({'varname': np.arange(n_series) if varnames is None else list(varnames)})
+    if len(descriptions) != n_series:
+        raise Exception("Please provide one varname per series.")
+
+    # orders of each series and safety setting (blocks), the part not depending on the capital and the commission
+    safety = np.atleast_1d(safety).tolist()
+    blocks = [signal_orders(prices[i, :lengths[i]], signals[i, :lengths[i]], safe) for i in range(n_series) for safe in safety]
+
+    # columns: every combination of block, capital and commission, executed together in chunks of blocks
+    grid_capital, grid_commission = [grid.reshape(-1) for grid in np.meshgrid(np.atleast_1d(initial_capital).astype(np.float64),
+                                                                              np.atleast_1d(trading_commission).astype(np.float64),
+                                                                              indexing='ij')]
+    n_grid = len(grid_capital)
+    max_trades = max([len(block[2]) for block in blocks] + [0])
+    chunk_blocks = max(1, chunk_elements // (n_grid * (max_trades + 1)))
+
+    columns = {key: [] for key in ('ending_capital', 'buys', 'winners', 'losers', 'n_executed', 'total_transaction_cost')}
+    for start in range(0, len(blocks), chunk_blocks):
+        for key, values in _evaluate_blocks(blocks[start:(start + chunk_blocks)], grid_capital, grid_commission).items():
+            columns[key].append(values)
+
+    columns = {key: np.concatenate(values) for key, values in columns.items()}
+    columns['series'] = np.repeat(np.arange(n_series), len(safety) * n_grid)
+    columns['safety'] = np.tile(np.repeat(safety, n_grid), n_series)
+    columns['initial_capital'] = np.tile(grid_capital, n_series * len(safety))
+    columns['trading_commission'] = np.tile(grid_commission, n_series * len(safety))
+    columns['n_steps'] = np.repeat([len(block[0]) for block in blocks], n_grid)
+    columns['sells'] = columns['n_executed'] - columns['buys']
+
+    # measurements of all the combinations together
+    ending_capital = columns['ending_capital'].astype(np.float64)
+    initial = columns['initial_capital'].astype(np.float64)
+    all_trades = columns['buys'] + columns['sells']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_profit = ending_capital - initial
+        results = {'initial_capital': columns['initial_capital'],
+                   'trading_commission': columns['trading_commission'],
+                   'safety': columns['safety'],
+                   'total_profit_loss': total_profit,
+                   'cumulative_return': total_profit / initial,
+                   'annualized_return': _annualized_return(ending_capital/initial, columns['n_steps']),
+                   'all_trades': all_trades,
+                   'winners': columns['winners'],
+                   'losers': columns['losers'],
+                   'success_ratio': columns['winners']/all_trades,
+                   'total_transaction_cost': columns['total_transaction_cost'].astype(np.float64),
+                   'avg_trade_profit': np.where(total_profit > 0, total_profit / columns['winners'], np.nan),
+                   'avg_trade_loss': np.where(total_profit < 0, total_profit / columns['losers'], np.nan),
+                   'avg_profit_loss_trade': total_profit/all_trades,
+                   'buys': columns['buys'],
+                   'sells': columns['sells']}
+
+    return(pd.concat([descriptions.iloc[columns['series']].reset_index(drop=True), pd.DataFrame(results)], axis=1))
+
+
+
+def _evaluate_blocks(blocks, grid_capital, grid_commission):
+    """Executed trades and capital measurements of a chunk of blocks (signal_orders outputs) for every combination
+    of capital and commission (columns: block after block, all the combinations of each)."""
+    n_grid = len(grid_capital)
+    n_trades = np.array([len(trades) for prices, sell, trades, is_buy in blocks])
+    n_rows = max(n_trades.max(initial=0), 1)
+
+    # per block (padded): price, direction and sell order of each trade, price and sell order one step before
+    trade_prices = np.zeros((n_rows, len(blocks)))
+    is_buy = np.zeros((n_rows, len(blocks)), dtype=bool)
+    trade_sell = np.zeros((n_rows, len(blocks)), dtype=bool)
+    before_prices = np.zeros((n_rows, len(blocks)))
+    before_sell = np.zeros((n_rows, len(blocks)), dtype=bool)
+    has_before = np.zeros((n_rows, len(blocks)), dtype=bool)
+    last_price = np.zeros(len(blocks))
+    last_sell = np.zeros(len(blocks), dtype=bool)
+    has_steps = np.zeros(len(blocks), dtype=bool)
+    for b, (prices, sell, trades, trade_is_buy) in enumerate(blocks):
+        n = len(trades)
+        trade_prices[:n, b] = prices[trades]
+        is_buy[:n, b] = trade_is_buy
+        trade_sell[:n, b] = sell[trades]
+        before_prices[:n, b] = prices[np.maximum(trades - 1, 0)]
+        before_sell[:n, b] = sell[np.maximum(trades - 1, 0)]
+        has_before[:n, b] = trades > 0
+        if len(prices) > 0:
+            last_price[b], last_sell[b], has_steps[b] = prices[-1], sell[-1], True
+
+    def per_column(array):
+        return(np.repeat(array, n_grid, axis=-1))
+
+    capital = np.tile(grid_capital, len(blocks))
+    commission = np.tile(grid_commission, len(blocks))
+    money, units, n_executed = execute_trades_grid(per_column(trade_prices), per_column(is_buy), capital, commission,
+                                                   per_column(n_trades))
+    all_columns = np.arange(len(capital))
+
+    # capital just before and after each trade, and at the end
+    with np.errstate(invalid='ignore'):
+        before = np.where(per_column(has_before), _capital_at(per_column(before_prices), per_column(before_sell), money[:-1], units[:-1]), capital)
+        after = _capital_at(per_column(trade_prices), per_column(trade_sell), money[1:], units[1:])
+        executed = np.arange(n_rows)[:, np.newaxis] < n_executed
+        ending = _capital_at(per_column(last_price), per_column(last_sell), money[n_executed, all_columns], units[n_executed, all_columns])
+    ending = np.where(per_column(has_steps), ending, capital)
+
+    buys = np.concatenate((np.zeros((1, len(capital)), dtype=np.int64), np.cumsum(per_column(is_buy), axis=0)))
+    # fees summed one trade after the other (as financial_evaluation)
+    fees = np.cumsum(np.broadcast_to(commission, (n_rows, len(capital))), axis=0)
+
+    return({'ending_capital': ending,
+            'buys': buys[n_executed, all_columns],
+            'winners': np.count_nonzero((after > before) & executed, axis=0),
+            'losers': np.count_nonzero((after < before) & executed, axis=0),
+            'n_executed': n_executed,
+            'total_transaction_cost': np.where(n_executed > 0, fees[np.maximum(n_executed - 1, 0), all_columns], 0.)})
+
+
 if __name__ == "__main__":
     prices = [.1, .5, .2, 1.1, .4, .8, .55, .12, .3, .14]
     signals = ["Sell", "Buy", "Hold", "Hold", "Buy", "Sell", "Hold", "Buy", "Buy", "Hold"]
@@ -0,0 +1,293 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from scipy.stats import ttest_rel
+
+
+## Statistics of paired samples (computed along the last axis, so for many pairs and resamples at once)
+def mean_difference(x, y):
+    """mean(x) - mean(y)"""
+    return np.mean(x, axis=-1) - np.mean(y, axis=-1)
+
+
+def std_ratio(x, y):
+    """|std(y) / std(x)| - 1 (the equal variances statistic of the evaluation notebooks)"""
+    return np.abs(np.std(y, axis=-1) / np.std(x, axis=-1)) - 1
+
+
+# the mean statistics of mlxtend's permutation_test, as a function of mean(x) - mean(y)
+MEAN_STATISTICS = {'x_mean != y_mean': np.abs,
+                   'x_mean > y_mean': np.positive,
+                   'x_mean < y_mean': np.negative}
+
+
+def permutation_tests(x, y, func='x_mean != y_mean', method='approximate', num_rounds=10000, seed=None, n_jobs=1,
+                      chunk_rounds=1000):
+    """Paired permutation tests of many pairs of samples at once (as mlxtend.evaluate.permutation_test with
+    paired=True): the values of x and y are swapped at random for each observation (sign flips of the differences),
+    and the p-value is the share of the rounds with a statistic at least as extreme as the one of the samples.
+    The rounds are drawn in chunks of chunk_rounds (one random generator each, spawned from seed), which can be spread
+    over worker processes; the p-values do not depend on n_jobs.
+
+    Parameters
+    -------------------------------
+        x, y : np.array of shape (n_pairs, n) (or (n,) for one pair)
+            paired samples (e.g. the results of two strategies on the same assets)
+
+        func : str or function (default = 'x_mean != y_mean')
+            'x_mean != y_mean', 'x_mean > y_mean', 'x_mean < y_mean' or a function of (x, y) computing the statistic
+            along the last axis (e.g. std_ratio, module level functions only if n_jobs is not 1)
+
+        method : str (default = 'approximate')
+            'approximate' (num_rounds random rounds) or 'exact' (all 2**n swaps, for small n)
+
+        num_rounds : int (default = 10000)
+            number of rounds of the approximate method
+
+        seed : int or np.random.SeedSequence (default = None)
+            seed of the rounds
+
+        n_jobs : int (default = 1)
+            number of worker processes (None: all cores, 1 computes everything in this process)
+
+        chunk_rounds : int (default = 1000)
+            number of rounds drawn and computed together
+
+    Returns
+    ------------------------------
+        p_values : np.array of shape (n_pairs,) (or a float for one pair)
+    """
+    x, y, single = _pairs(x, y)
+    n = x.shape[-1]
+
+    reference = _permutation_statistic(x, y, func, np.ones((1, n), dtype=bool))[0]
+
+    if method == 'exact':
+        if n > 30:
+            raise Exception('Too many observations for the exact method (2**' + str(n) + ' swaps), please use the approximate one.')
+        num_rounds = 2**n
+        tasks = [(x, y, func, reference, ('exact', start, min(start + chunk_rounds, num_rounds)))
+                 for start in range(0, num_rounds, chunk_rounds)]
+    elif method == 'approximate':
+        sizes = _chunk_sizes(num_rounds, chunk_rounds)
+        seeds = _seed_sequence(seed).spawn(len(sizes))
+        tasks = [(x, y, func, reference, ('approximate', seed_i, size)) for seed_i, size in zip(seeds, sizes)]
+    else:
+        raise Exception("Please choose method 'exact' or 'approximate'.")
+
+    at_least_as_extreme = np.sum(_run_chunks(_permutation_chunk, tasks, n_jobs), axis=0)
+    p_values = at_least_as_extreme / num_rounds
+    return p_values[0] if single else p_values
+
+
+def bootstrap_tests(x, y, func=mean_difference, num_rounds=10000, confidence=0.95, seed=None, n_jobs=1,
+                    chunk_rounds=1000):
+    """Paired bootstrap of a statistic for many pairs of samples at once: the observations (pairs of x and y values)
+    are resampled with replacement, drawn as index matrices in chunks of chunk_rounds (one random generator each,
+    spawned from seed) that can be spread over worker processes.
+
+    Parameters
+    -------------------------------
+        x, y : np.array of shape (n_pairs, n) (or (n,) for one pair)
+            paired samples
+
+        func : function (default = mean_difference)
+            function of (x, y) computing the statistic along the last axis (module level functions only if n_jobs is not 1)
+
+        num_rounds : int (default = 10000)
+            number of bootstrap samples
+
+        confidence : float (default = 0.95)
+            level of the percentile confidence interval
+
+        seed, n_jobs, chunk_rounds :
+            same as in permutation_tests
+
+    Returns
+    ------------------------------
+        results : dict of np.arrays of shape (n_pairs,)
+            'estimate' : statistic of the samples
+            'ci_lower', 'ci_upper' : percentile confidence interval
+            'p_value' : two-sided p-value of a statistic of 0 (share of bootstrap statistics at least as far from the
+                        estimate as 0 is)
+    """
+    x, y, single = _pairs(x, y)
+
+    sizes = _chunk_sizes(num_rounds, chunk_rounds)
+    seeds = _seed_sequence(seed).spawn(len(sizes))
+    tasks = [(x, y, func, seed_i, size) for seed_i, size in zip(seeds, sizes)]
+    statistics = np.concatenate(_run_chunks(_bootstrap_chunk, tasks, n_jobs), axis=0)
+
+    estimate = func(x, y)
+    alpha = (1 - confidence) / 2
+    results = {'estimate': estimate,
+               'ci_lower': np.quantile(statistics, alpha, axis=0),
+               'ci_upper': np.quantile(statistics, 1 - alpha, axis=0),
+               'p_value': np.mean(np.abs(statistics - estimate) >= np.abs(estimate), axis=0)}
+    return {key: value[0] for key, value in results.items()} if single else results
+
+
+def t_tests(x, y):
+    """Paired t-tests of many pairs of samples at once (scipy.stats.ttest_rel along the last axis).
+
+    Returns
+    ------------------------------
+        statistics, p_values : np.array of shape (n_pairs,) (or floats for one pair)
+    """
+    result = ttest_rel(x, y, axis=-1)
+    return result[0], result[1]
+
+
+def compare_strategies(results,
+                       strategies=None,
+                       pairs=None,
+                       num_rounds=100000,
+                       method='approximate',
+                       confidence=0.95,
+                       seed=0,
+                       n_jobs=None,
+                       chunk_rounds=1000):
+    """Significance of the differences between strategies from their results on the same assets: paired permutation
+    tests of equal means and of equal variances (as in the evaluation notebooks), a paired bootstrap of the difference
+    of the means and paired t-tests, for all pairs of strategies at once.
+
+    Parameters
+    -------------------------------
+        results : pd.DataFrame or np.array
+            results with one column per strategy and one row per asset (e.g. the annualized returns), or an array of
+            shape (n_strategies, n_assets)
+
+        strategies : list of str (default = None)
+            names of the strategies of an array (the columns of a DataFrame, numbers if not defined)
+
+        pairs : list of (str, str) tuples (default = None)
+            pairs of strategies to compare (Strategy 1, Strategy 2), all pairs if not defined
+
+        num_rounds : int (default = 100000)
+            number of rounds of the permutation tests and of bootstrap samples
+
+        method : str (default = 'approximate')
+            method of the permutation tests ('approximate' or 'exact')
+
+        confidence : float (default = 0.95)
+            level of the bootstrap confidence interval
+
+        seed : int (default = 0)
+            seed of all the resamples (the results do not depend on n_jobs)
+
+        n_jobs : int (default = None)
+            number of worker processes (all cores if not defined, 1 computes everything in this process)
+
+        chunk_rounds : int (default = 1000)
+            number of rounds drawn and computed together
+
+    Returns
+    ------------------------------
+        comparison : pd.DataFrame
+            one row per pair of strategies, with the difference of the means, the p-values of each test and the
+            bootstrap confidence interval of the difference of the means
+    """
+    if isinstance(results, pd.DataFrame):
+        strategies = list(results.columns)
+        values = np.asarray(results, dtype=np.float64).T
+    else:
+        values = np.asarray(results, dtype=np.float64)
+        strategies = list(range(len(values))) if strategies is None else list(strategies)
+    if len(strategies) != len(values):
+        raise Exception('Please provide one name per strategy.')
+
+    pairs = list(combinations(strategies, 2)) if pairs is None else list(pairs)
+    position = {strategy: i for i, strategy in enumerate(strategies)}
+    x = values[[position[strategy1] for strategy1, strategy2 in pairs]]
+    y = values[[position[strategy2] for strategy1, strategy2 in pairs]]
+
+    # independent resamples for each test, all from seed
+    seed_means, seed_variances, seed_bootstrap = _seed_sequence(seed).spawn(3)
+    p_means = permutation_tests(x, y, 'x_mean != y_mean', method, num_rounds, seed_means, n_jobs, chunk_rounds)
+    p_variances = permutation_tests(x, y, std_ratio, method, num_rounds, seed_variances, n_jobs, chunk_rounds)
+    bootstrap = bootstrap_tests(x, y, mean_difference, num_rounds, confidence, seed_bootstrap, n_jobs, chunk_rounds)
+    t_statistics, p_t = t_tests(x, y)
+
+    return pd.DataFrame({'Strategy 1': [strategy1 for strategy1, strategy2 in pairs],
+                         'Strategy 2': [strategy2 for strategy1, strategy2 in pairs],
+                         'mean difference': bootstrap['estimate'],
+                         'p-value (equal means)': p_means,
+                         'p-value (equal variances)': p_variances,
+                         'p-value (bootstrap)': bootstrap['p_value'],
+                         'ci lower (bootstrap)': bootstrap['ci_lower'],
+                         'ci upper (bootstrap)': bootstrap['ci_upper'],
+                         't statistic': t_statistics,
+                         'p-value (t-test)': p_t})
+
+
+def _pairs(x, y):
+    """x and y as (n_pairs, n) float arrays, and whether a single pair was given."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape:
+        raise Exception('Please provide paired samples of the same shape.')
+    single = x.ndim == 1
+    return np.atleast_2d(x), np.atleast_2d(y), single
+
+
+def _permutation_statistic(x, y, func, keep):
+    """Statistic of each pair for each row of keep (whether x and y are kept or swapped for each observation),
+    of shape (n_rounds, n_pairs)."""
+    if isinstance(func, str):
+        if func not in MEAN_STATISTICS:
+            raise Exception("Unknown statistic " + func + ", please choose from 'x_mean != y_mean', 'x_mean > y_mean', "
+                            "'x_mean < y_mean' or give a function.")
+        # a swap flips the sign of the difference of the observation
+        signs = np.where(keep, 1., -1.)
+        return MEAN_STATISTICS[func](signs @ (x - y).T / x.shape[-1])
+
+    keep = keep[:, np.newaxis, :]
+    return func(np.where(keep, x, y), np.where(keep, y, x))
+
+
+def _permutation_chunk(x, y, func, reference, rounds):
+    """Number of rounds with a statistic at least as extreme as the reference, for each pair (one task of
+    permutation_tests). rounds is ('exact', first swap, last swap + 1) or ('approximate', seed, number of rounds)."""
+    n = x.shape[-1]
+    if rounds[0] == 'exact':
+        # swap number i: bits of i
+        keep = ((np.arange(rounds[1], rounds[2])[:, np.newaxis] >> np.arange(n)) & 1) == 0
+    else:
+        keep = np.random.default_rng(rounds[1]).random((rounds[2], n)) >= 0.5
+
+    statistics = _permutation_statistic(x, y, func, keep)
+    return np.sum((statistics > reference) | np.isclose(statistics, reference), axis=0)
+
+
+def _bootstrap_chunk(x, y, func, seed, n_rounds):
+    """Statistics of n_rounds bootstrap samples for each pair, of shape (n_rounds, n_pairs) (one task of
+    bootstrap_tests)."""
+    index = np.random.default_rng(seed).integers(0, x.shape[-1], size=(n_rounds, x.shape[-1]))
+    return func(x[:, index].transpose(1, 0, 2), y[:, index].transpose(1, 0, 2))
+
+
+def _chunk_sizes(num_rounds, chunk_rounds):
+    """Number of rounds of each chunk."""
+    return [min(chunk_rounds, num_rounds - start) for start in range(0, num_rounds, chunk_rounds)]
+
+
+def _seed_sequence(seed):
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def _run_chunks(function, tasks, n_jobs):
+    """Results of function on each task (tuple of arguments), in the order of the tasks, on a process pool unless
+    n_jobs is 1."""
+    if n_jobs == 1:
+        return [function(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(function, *zip(*tasks)))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    annualized_returns = pd.DataFrame(rng.normal(0.05, 0.2, (30, 4)), columns=['CNN-i', 'CNN-u', 'RSI', 'BaH'])
+    annualized_returns['CNN-i'] += 0.1
+
+    print(compare_strategies(annualized_returns, num_rounds=10000))
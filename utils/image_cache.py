@@ -0,0 +1,248 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: the index is merged without a lock
+    fcntl = None
+
+from labelled_image_preparation import labels_and_image_series, image_shape, image_channels
+from labels.trading_strategies import local_min_max, local_min_max_sweep
+from transform.multi_transform import multi_transform_batch
+
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+
+
+class ImageCache:
+    """On-disk cache of data_to_labelled_img results, keyed by the content of the input series and the parameters.
+    The labels and every image channel are stored as separate entries, so a build that only adds a transformation
+    (e.g. 'GADF' to ['RP', 'GASF']) or changes the parameters of one channel only computes what is new.
+    When the cache grows over max_bytes the least recently used entries are removed. All entries are .npy arrays (the
+    labels are stored as label codes, the rest of the labelling outputs is rebuilt from them and the series).
+    Several instances (or processes) can share a directory: the index is reloaded and merged under a file lock before
+    each save, and eviction also removes the files that no index entry refers to.
+
+    Parameters
+    -------
+        path : str
+            directory of the cache (created if needed)
+
+        max_bytes : int (default = 10 GB)
+            size limit of the stored entries
+    """
+    def __init__(self, path, max_bytes=10 * 2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+        self.index = self._read_index()
+        # keys removed by this instance since the last save, so that merging does not bring them back
+        self.removed = set()
+
+    def data_to_labelled_img(self, data, column_name, label_window_size, image_window_size, image_trf_strat,
+                             num_bin=5,
+                             padding_RP=0,
+                             standardize_out_RP=False,
+                             standardize_out_GASF=False,
+                             standardize_out_GADF=False,
+                             use_returns=False,
+                             dtype=np.float64,
+                             image_size=None):
+        """data_to_labelled_img (same parameters and returns) served from the cache, computing only the missing entries."""
+        if image_window_size < np.ceil(np.max(label_window_size)/2):
+            print('image_window_size must be >= np.ceil(label_window_size/2), please choose a grater image window size.')
+            return()
+
+        trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+        if len(trf_list)==0:
+            print('Please define the image_trf_strat: GASF, GADF, RP, MTF or MTF_new')
+            return()
+
+        series_hash = hashlib.sha256(np.ascontiguousarray(np.asarray(data[column_name].values, dtype=np.float64)).tobytes()).hexdigest()
+        labels_key = _key(series_hash, 'labels', label_window_size, image_window_size, use_returns)
+
+        # label codes (the labelling outputs are rebuilt from them)
+        codes = self._load(labels_key)
+        cached_labels = codes is not None
+        if not cached_labels:
+            prices = np.array(data[column_name].values)
+            if np.ndim(label_window_size) == 0:
+                codes = local_min_max(prices, label_window_size, labelled_output=False)
+            else:
+                codes = local_min_max_sweep(prices, label_window_size)
+        labelled_pd, price_at_image, image_labels, label_names, series = labels_and_image_series(
+            data, column_name, label_window_size, image_window_size, use_returns=use_returns, labels=codes)
+        if cached_labels:
+            label_names = {int(k): v for k, v in self.index[labels_key]['label_names'].items()}
+        else:
+            self._store(labels_key, codes, label_names=label_names)
+
+        n_images = len(series) - image_window_size + 1
+        if n_images < 1:
+            print('Image window size should not exceed the length of the data.')
+            return()
+
+        images = np.empty((n_images,) + image_shape(image_trf_strat, image_window_size, padding_RP, image_size), dtype=dtype)
+        channels = image_channels(image_trf_strat, images)
+
+        # parameters each channel depends on
+        channel_params = {'GASF': (standardize_out_GASF,),
+                          'GADF': (standardize_out_GADF,),
+                          'RP': (padding_RP, standardize_out_RP),
+                          'MTF': (num_bin,),
+                          'MTF_new': (num_bin,)}
+        keys = [_key(labels_key, trf, channel_params.get(trf), np.dtype(dtype).str, image_size) for trf in trf_list]
+
+        # cached channels
+        quantization = {}
+        missing = []
+        for c, (trf, key) in enumerate(zip(trf_list, keys)):
+            channel = self._load(key)
+            if channel is None:
+                missing.append(c)
+            else:
+                channels[..., c] = channel
+                quantization[trf] = self.index[key].get('quantization')
+
+        # missing channels, computed together in one pass
+        if len(missing) > 0:
+            result = multi_transform_batch(series, image_window_size, [trf_list[c] for c in missing],
+                                           num_bin=num_bin,
+                                           padding_RP=padding_RP,
+                                           standardize_out_RP=standardize_out_RP,
+                                           standardize_out_GASF=standardize_out_GASF,
+                                           standardize_out_GADF=standardize_out_GADF,
+                                           dtype=dtype,
+                                           image_size=image_size)
+            computed, computed_quantization = result if isinstance(result, tuple) else (result, {})
+            for i, c in enumerate(missing):
+                channels[..., c] = computed[..., i]
+                quantization[trf_list[c]] = computed_quantization.get(trf_list[c])
+                self._store(keys[c], computed[..., i], quantization=quantization[trf_list[c]])
+
+        self._evict(keep=[labels_key] + keys)
+
+        if np.dtype(dtype) == np.uint8:
+            quantization = {trf: tuple(q) for trf, q in quantization.items()}
+            return(labelled_pd, price_at_image, images, image_labels, label_names, quantization)
+        return(labelled_pd, price_at_image, images, image_labels, label_names)
+
+    def size(self):
+        """Total size of the stored entries in bytes."""
+        return sum(entry['size'] for entry in self.index.values())
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock():
+            self._merge_index()
+            for key in list(self.index):
+                self._remove(key)
+            self._remove_unindexed()
+            self._write_index()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def _load(self, key):
+        """Cached entry (None if missing), marked as used (in memory, the index is saved by _evict)."""
+        if key not in self.index:
+            return None
+        if not os.path.exists(self._file(key)):
+            self._remove(key)
+            return None
+        entry = np.load(self._file(key), allow_pickle=False)
+        self.index[key]['last_used'] = time.time()
+        return entry
+
+    def _store(self, key, entry, quantization=None, label_names=None):
+        """Store an array (.npy)."""
+        # the file is written under the lock, so that an eviction never sees it without its index entry
+        with self._lock():
+            np.save(self._file(key), np.ascontiguousarray(entry), allow_pickle=False)
+            self.index[key] = {'size': os.path.getsize(self._file(key)), 'last_used': time.time()}
+            if quantization is not None:
+                self.index[key]['quantization'] = list(quantization)
+            if label_names is not None:
+                self.index[key]['label_names'] = {str(k): v for k, v in label_names.items()}
+            self.removed.discard(key)
+            self._merge_index()
+            self._write_index()
+
+    def _evict(self, keep=()):
+        """Remove the least recently used entries (except keep) until the cache fits in max_bytes, and the files that
+        are not in the index (e.g. left by an interrupted process)."""
+        with self._lock():
+            self._merge_index()
+            total = self.size()
+            for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+                if total <= self.max_bytes:
+                    break
+                if key in keep:
+                    continue
+                total -= self.index[key]['size']
+                self._remove(key)
+            self._remove_unindexed()
+            self._write_index()
+
+    def _remove(self, key):
+        if os.path.exists(self._file(key)):
+            os.remove(self._file(key))
+        del self.index[key]
+        self.removed.add(key)
+
+    def _remove_unindexed(self):
+        for file_name in os.listdir(self.path):
+            if file_name.endswith('.npy') and (file_name[:-len('.npy')] not in self.index):
+                os.remove(os.path.join(self.path, file_name))
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Exclusive lock of the index, held while it is merged and saved."""
+        with open(os.path.join(self.path, LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        with open(index_path) as f:
+            return json.load(f)
+
+    def _merge_index(self):
+        """Add the entries saved by other instances to the index (to be called under the lock). Entries removed here
+        stay removed, for entries known to both the latest use is kept."""
+        for key, entry in self._read_index().items():
+            if key in self.removed:
+                continue
+            if key not in self.index:
+                self.index[key] = entry
+            else:
+                self.index[key]['last_used'] = max(self.index[key]['last_used'], entry['last_used'])
+        # entries removed by other instances (their files are gone)
+        for key in [key for key in self.index if not os.path.exists(self._file(key))]:
+            del self.index[key]
+        self.removed.clear()
+
+    def _write_index(self):
+        # written under a temporary name and renamed, so that other processes never read a partly written index
+        tmp = os.path.join(self.path, INDEX_FILE + '.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+
+def _key(*parts):
+    """Hash of the given parts (strings, numbers, tuples), used as entry name."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+
+from labelled_image_preparation import labels_and_image_series, image_shape, image_channels
+from transform.multi_transform import multi_transform_batch
+
+# batches can be fed to Keras directly if tensorflow is available, otherwise a plain Python object is used
+try:
+    from tensorflow.keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
+
+class LabelledImageSequence(Sequence):
+    """Labelled images of one or more series, created on the fly batch by batch instead of kept in memory.
+    Only the series and the labels are stored; the images of a batch are the same as the ones data_to_labelled_img
+    returns for the same positions. Can be given to Keras' model.fit as a Sequence, or iterated over with batches().
+
+    Parameters
+    -------
+        datas : pandas (time) series or list of them
+            input data (one per asset)
+
+        column_names : str or list of str
+            name of column to transform in each data
+
+        label_window_size : int or list of int
+            the window size for data labelling (needs to be odd, should be smaller than length of series),
+            or several window sizes (see data_to_labelled_img)
+
+        image_window_size : int
+            the window size for image creation
+
+        image_trf_strat : string or list of strings ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new')
+            the image transformation strategy (see data_to_labelled_img)
+
+        batch_size : int (default = 32)
+            number of images per batch
+
+        order : np.array (default = None)
+            order of the images (indices into all images of all assets, assets one after the other);
+            if not defined the images are in time order per asset
+
+        shuffle : bool (default = False)
+            whether the order should be shuffled at the start and at the end of each epoch
+
+        seed : int (default = None)
+            seed of the shuffling
+
+        dtype : numpy dtype (default = np.float32)
+            type of the images: float64, float32 or float16
+
+        num_bin, padding_RP, standardize_out_RP, standardize_out_GASF, standardize_out_GADF, use_returns, image_size :
+            same as in data_to_labelled_img
+
+    Attributes
+    -------
+        image_labels : np.array
+            one-hot labels of all images (assets one after the other)
+            (of shape (n_sizes, n_images, 3) for a list of label_window_size, batches then have labels of shape
+            (n_sizes, batch_size, 3))
+
+        price_at_image : np.array
+            the last price used to create each image
+
+        asset : np.array
+            index of the asset of each image
+
+        label_names :
+            dictionary linking strategy name to column index in image_labels
+    """
+    def __init__(self, datas, column_names, label_window_size, image_window_size, image_trf_strat,
+                 batch_size=32,
+                 order=None,
+                 shuffle=False,
+                 seed=None,
+                 dtype=np.float32,
+                 num_bin=5,
+                 padding_RP=0,
+                 standardize_out_RP=False,
+                 standardize_out_GASF=False,
+                 standardize_out_GADF=False,
+                 use_returns=False,
+                 image_size=None):
+        super().__init__()
+
+        if isinstance(datas, (pd.DataFrame, pd.Series)):
+            datas = [datas]
+        if isinstance(column_names, str):
+            column_names = [column_names] * len(datas)
+
+        # quantization ranges of RP images depend on the windows, images of different batches would not be comparable
+        if np.dtype(dtype) not in (np.float64, np.float32, np.float16):
+            raise Exception('Image dtype of the generator should be float64, float32 or float16.')
+
+        self.image_window_size = image_window_size
+        self.image_trf_strat = image_trf_strat
+        self.trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+        self.image_shape = image_shape(image_trf_strat, image_window_size, padding_RP, image_size)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.dtype = dtype
+        self.transform_params = dict(num_bin=num_bin,
+                                     padding_RP=padding_RP,
+                                     standardize_out_RP=standardize_out_RP,
+                                     standardize_out_GASF=standardize_out_GASF,
+                                     standardize_out_GADF=standardize_out_GADF,
+                                     image_size=image_size)
+
+        # series to create the images from and labels, per asset
+        self.series = []
+        image_labels = []
+        price_at_image = []
+        for data, column_name in zip(datas, column_names):
+            labelled_pd, prices, labels, self.label_names, series = labels_and_image_series(
+                data, column_name, label_window_size, image_window_size, use_returns=use_returns)
+            self.series.append(series)
+            image_labels.append(labels)
+            price_at_image.append(prices)
+
+        # labels of a list of label_window_size have a first axis of window sizes
+        self.image_labels = np.concatenate(image_labels, axis=-2)
+        self.price_at_image = np.concatenate(price_at_image)
+
+        # asset and position in the asset's series of each image
+        n_images = [labels.shape[-2] for labels in image_labels]
+        self.asset = np.repeat(np.arange(len(n_images)), n_images)
+        self.position = np.arange(len(self.asset)) - np.repeat(np.cumsum(n_images) - n_images, n_images)
+
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(self.asset)) if order is None else np.asarray(order)
+        if shuffle:
+            self.order = self.rng.permutation(self.order)
+
+    def __len__(self):
+        """Number of batches."""
+        return int(np.ceil(len(self.order) / self.batch_size))
+
+    def __getitem__(self, idx):
+        """Batch idx: (images, image_labels)."""
+        indices = self.order[(idx * self.batch_size):((idx + 1) * self.batch_size)]
+        return self.images(indices), self.image_labels[..., indices, :]
+
+    def on_epoch_end(self):
+        """Reshuffle the order after each epoch (if shuffle)."""
+        if self.shuffle:
+            self.order = self.rng.permutation(self.order)
+
+    def batches(self, epochs=1):
+        """Python generator of (images, image_labels) batches for the given number of epochs (None: endless)."""
+        epoch = 0
+        while (epochs is None) or (epoch < epochs):
+            for idx in range(len(self)):
+                yield self[idx]
+            self.on_epoch_end()
+            epoch += 1
+
+    def images(self, indices):
+        """Images at the given indices (into all images of all assets), in the order of indices.
+        Consecutive images of an asset are transformed together from one slice of its series."""
+        indices = np.asarray(indices).reshape(-1)
+        unique, inverse = np.unique(indices, return_inverse=True)
+
+        images = np.empty((len(unique),) + self.image_shape, dtype=self.dtype)
+
+        # runs of consecutive positions in the same asset
+        breaks = np.flatnonzero((np.diff(unique) != 1) | (np.diff(self.asset[unique]) != 0)) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(unique)]))
+
+        for start, end in zip(starts, ends):
+            asset = self.asset[unique[start]]
+            first = self.position[unique[start]]
+            series = self.series[asset][first:(first + end - start + self.image_window_size - 1)]
+
+            multi_transform_batch(series, self.image_window_size, self.trf_list, dtype=self.dtype,
+                                  out=image_channels(self.image_trf_strat, images[start:end]), **self.transform_params)
+
+        return images[inverse.reshape(-1)]
+
+
+if __name__ == "__main__":
+    dta = pd.DataFrame(data=np.cumsum(np.random.normal(0, 2.3, 400)) + 100, columns=["Series"])
+
+    sequence = LabelledImageSequence(
+        datas=dta, column_names="Series", label_window_size=5, image_window_size=20, image_trf_strat=["RP", "GASF", "MTF"],
+        batch_size=32, shuffle=True, seed=0, padding_RP=1, use_returns=True)
+
+    print(len(sequence))
+    images, image_labels = sequence[0]
+    print(images.shape, image_labels.shape)
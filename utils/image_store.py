@@ -0,0 +1,275 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from labelled_image_preparation import data_to_labelled_img
+
+
+# Files of an image store (in one directory)
+STORE_ARRAYS = ('images', 'image_labels', 'price_at_image')
+MANIFEST_FILE = 'manifest.json'
+
+# bytes reserved for the .npy header, so that it can be rewritten in place when the arrays grow
+HEADER_SIZE = 256
+
+
+class ImageStoreWriter:
+    """Write the labelled images of assets to disk one asset at a time (e.g. data_to_labelled_img outputs).
+    images, image_labels and price_at_image are appended to .npy files in a directory, so writing is linear in the
+    dataset size and only one asset is held in memory. A manifest records the rows of each asset (a list of row ranges,
+    an asset extended with new bars later has more than one). The files are valid .npy files after every append and
+    can be opened memory-mapped with open_image_store.
+
+    Parameters
+    -------
+        path : str
+            directory of the store (created if needed)
+
+        overwrite : bool (default = False)
+            whether an existing store in path should be replaced, otherwise new assets are appended to it (data files
+            without a manifest, e.g. of a store whose first append was interrupted, are only replaced with overwrite)
+    """
+    def __init__(self, path, overwrite=False):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if (not overwrite) and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+            self.files = {name: open(os.path.join(path, name + '.npy'), 'r+b') for name in STORE_ARRAYS}
+
+            # continue after the rows of the manifest: rows of an interrupted append (written before the manifest)
+            # are dropped, otherwise the new rows would not be aligned across the arrays
+            for name, f in self.files.items():
+                end = 0
+                if name in self.manifest['arrays']:
+                    layout = self.manifest['arrays'][name]
+                    row_nbytes = np.dtype(layout['descr']).itemsize * int(np.prod(layout['shape']))
+                    end = HEADER_SIZE + self.manifest['n_rows'] * row_nbytes
+                if os.fstat(f.fileno()).st_size < end:
+                    raise Exception(name + '.npy is shorter than the ' + str(self.manifest['n_rows']) + ' rows of the manifest.')
+                f.seek(end)
+                f.truncate()
+            self.flush()
+        else:
+            existing = [name + '.npy' for name in STORE_ARRAYS if os.path.exists(os.path.join(path, name + '.npy'))]
+            if (not overwrite) and len(existing) > 0:
+                raise Exception(path + ' has data files (' + ', '.join(existing) + ') but no manifest, '
+                                + 'use overwrite = True to replace them.')
+            self.manifest = {'n_rows': 0, 'arrays': {}, 'assets': {}, 'label_names': None, 'quantization': {},
+                             'params': None, 'context': {}}
+            self.files = {name: open(os.path.join(path, name + '.npy'), 'w+b') for name in STORE_ARRAYS}
+
+    def append(self, name, images, image_labels, price_at_image, label_names=None, quantization=None, extend=False):
+        """Append the images, labels and prices of one asset.
+
+        Parameters
+        -------
+            name : str
+                name of the asset (its rows are recorded in the manifest)
+
+            images, image_labels, price_at_image : np.array
+                outputs of data_to_labelled_img for the asset (same number of images; the labels of a list of
+                label_window_size, of shape (n_sizes, n_images, 3), are stored image by image)
+
+            label_names : dict (default = None)
+                dictionary linking strategy name to column index in image_labels
+
+            quantization : dict (default = None)
+                (scale, offset) of each transformation for uint8 images
+
+            extend : bool (default = False)
+                whether the rows are new images of an asset already in the store (added as a new row range)
+        """
+        # rows are images: per-size labels are stored as (n_images, n_sizes, 3)
+        image_labels = np.asarray(image_labels)
+        n_rows = len(images)
+        if (image_labels.shape[-2] != n_rows) or (len(price_at_image) != n_rows):
+            raise Exception('images, image_labels and price_at_image should have the same number of rows.')
+        arrays = {'images': images, 'image_labels': np.moveaxis(image_labels, -2, 0), 'price_at_image': price_at_image}
+        if (name in self.manifest['assets']) and (not extend):
+            raise Exception('Asset ' + str(name) + ' is already in the store.')
+
+        for array_name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout = {'descr': np.lib.format.dtype_to_descr(array.dtype), 'shape': list(array.shape[1:])}
+            if array_name not in self.manifest['arrays']:
+                self.manifest['arrays'][array_name] = layout
+            elif self.manifest['arrays'][array_name] != layout:
+                raise Exception(array_name + ' of ' + str(name) + ' should have type ' + self.manifest['arrays'][array_name]['descr']
+                                + ' and row shape ' + str(tuple(self.manifest['arrays'][array_name]['shape'])) + '.')
+
+        start = self.manifest['n_rows']
+        for array_name, array in arrays.items():
+            f = self.files[array_name]
+            if f.tell() == 0:
+                f.write(b'\0' * HEADER_SIZE)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+        self.manifest['n_rows'] = start + n_rows
+        self.manifest['assets'].setdefault(name, []).append([start, start + n_rows])
+        if label_names is not None:
+            self.manifest['label_names'] = {str(k): v for k, v in label_names.items()}
+        if quantization is not None:
+            # one per row range
+            self.manifest['quantization'].setdefault(name, []).append({trf: list(q) for trf, q in quantization.items()})
+        self.flush()
+
+    def flush(self):
+        """Rewrite the .npy headers with the current number of rows and save the manifest."""
+        for array_name, f in self.files.items():
+            if array_name not in self.manifest['arrays']:
+                continue
+            layout = self.manifest['arrays'][array_name]
+            position = f.tell()
+            f.seek(0)
+            f.write(_npy_header(layout['descr'], (self.manifest['n_rows'],) + tuple(layout['shape'])))
+            f.seek(position)
+            f.flush()
+
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+    def close(self):
+        """Write the headers and the manifest and close the files."""
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_image_store(path, mmap_mode='r'):
+    """Open an image store written by ImageStoreWriter.
+
+    Parameters
+    -------
+        path : str
+            directory of the store
+
+        mmap_mode : str (default = 'r')
+            memory-map mode of np.load (None loads the arrays into memory)
+
+    Returns
+    -----------------------------------------
+        images, image_labels, price_at_image : np.array (memory-mapped)
+            arrays of all assets, one asset after the other (per-size labels of a list of label_window_size as a
+            view of shape (n_sizes, n_images, 3))
+
+        manifest : dict
+            'assets' : name of each asset : list of [first row, last row + 1] ranges of its images, in time order
+            'label_names' : dictionary linking column index in image_labels to strategy name
+            'quantization' : name of each asset : (scale, offset) of each transformation for each row range, for uint8 images
+            'params' : parameters of data_to_labelled_img (for stores written by store_labelled_images)
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest['label_names'] is not None:
+        manifest['label_names'] = {int(k): v for k, v in manifest['label_names'].items()}
+
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in STORE_ARRAYS]
+    if arrays[1].ndim == 3:
+        arrays[1] = np.moveaxis(arrays[1], 0, 1)
+    return(arrays[0], arrays[1], arrays[2], manifest)
+
+
+def store_labelled_images(path, name, data, column_name, label_window_size, image_window_size, image_trf_strat, **params):
+    """data_to_labelled_img of one asset, appended to the image store in path (created if needed).
+    The parameters and the last bars of the series are recorded, so the asset can later be extended with
+    extend_labelled_images when new bars arrive. All assets of a store must use the same parameters.
+
+    Parameters
+    -------
+        path : str
+            directory of the store
+
+        name : str
+            name of the asset
+
+        data, column_name, label_window_size, image_window_size, image_trf_strat, **params :
+            same as in data_to_labelled_img
+    """
+    params = dict(params, label_window_size=label_window_size, image_window_size=image_window_size,
+                  image_trf_strat=image_trf_strat)
+    if 'dtype' in params:
+        params['dtype'] = np.dtype(params['dtype']).str
+
+    with ImageStoreWriter(path) as writer:
+        if writer.manifest['params'] is None:
+            writer.manifest['params'] = params
+        elif writer.manifest['params'] != json.loads(json.dumps(params)):
+            raise Exception('The parameters should be the same as for the other assets of the store: ' + str(writer.manifest['params']) + '.')
+
+        series = np.asarray(data[column_name].values, dtype=np.float64)
+        _append_images(writer, name, series, n_old=0, extend=False)
+
+
+def extend_labelled_images(path, name, new_data):
+    """Append the images of newly arrived bars of an asset of the store (written by store_labelled_images).
+    Only the windows that became complete are transformed, and only the labels that local_min_max can now assign
+    (label_window_size // 2 bars after them are known) are added, so the cost depends on the number of new bars and not
+    on the length of the history. The result is the same as rerunning data_to_labelled_img over the whole series.
+
+    Parameters
+    -------
+        path : str
+            directory of the store
+
+        name : str
+            name of the asset
+
+        new_data : np.array, list or pandas series
+            new bars of the series (following the last bar stored)
+    """
+    with ImageStoreWriter(path) as writer:
+        if name not in writer.manifest['context']:
+            raise Exception('Asset ' + str(name) + ' is not in the store (use store_labelled_images first).')
+
+        context = np.asarray(writer.manifest['context'][name], dtype=np.float64)
+        new_data = np.asarray(new_data, dtype=np.float64).reshape(-1)
+        if len(new_data) == 0:
+            return
+
+        # images (labels) already stored among the ones of context + new_data
+        params = writer.manifest['params']
+        n_old = max(len(context) - int(np.max(params['label_window_size'])/2) - _label_offset(params), 0)
+        _append_images(writer, name, np.concatenate((context, new_data)), n_old=n_old, extend=True)
+
+
+def _append_images(writer, name, series, n_old, extend):
+    """Images of series from the (n_old + 1)th on appended to the store, and the context of the asset updated."""
+    params = dict(writer.manifest['params'])
+    params['dtype'] = np.dtype(params.get('dtype', np.float64))
+    label_window_size, image_window_size = params['label_window_size'], params['image_window_size']
+
+    result = data_to_labelled_img(pd.DataFrame({'Series': series}), 'Series', **params)
+    if (len(result) > 0) and (len(result[2]) > n_old):
+        quantization = result[5] if len(result) > 5 else None
+        writer.append(name, result[2][n_old:], result[3][..., n_old:, :], result[1][n_old:],
+                      label_names=result[4], quantization=quantization, extend=extend)
+
+    # bars needed to continue the series: the labels of the next bars look back label_window_size // 2 bars (of the
+    # largest size), the next images image_window_size (one more for returns)
+    writer.manifest['context'][name] = list(series[-(image_window_size + int(np.max(label_window_size))):])
+
+
+def _label_offset(params):
+    """Index of the bar labelled in the first image (the first return is nan, so one later with returns)."""
+    return params['image_window_size'] if params.get('use_returns', False) == True else params['image_window_size'] - 1
+
+
+def _npy_header(descr, shape):
+    """.npy (version 1.0) header of HEADER_SIZE bytes for an array of type descr and given shape (C order)."""
+    header = "{'descr': " + repr(descr) + ", 'fortran_order': False, 'shape': " + repr(tuple(shape)) + ", }"
+    # magic string, version, header length, header padded with spaces and ending with a newline
+    preamble = np.lib.format.magic(1, 0) + (HEADER_SIZE - 10).to_bytes(2, 'little')
+    header = header.ljust(HEADER_SIZE - len(preamble) - 1) + '\n'
+    if len(preamble) + len(header) != HEADER_SIZE:
+        raise Exception('The shape ' + str(tuple(shape)) + ' does not fit in the .npy header.')
+    return(preamble + header.encode('latin1'))
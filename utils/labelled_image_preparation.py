@@ -3,12 +3,13 @@ import numpy as np
 import glob
 import matplotlib.pyplot as plt
 import os
+from collections import deque
 from sklearn.preprocessing import MinMaxScaler
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-from labels.trading_strategies import local_min_max
-from transform.gramian_angular_field import GASF, GADF
-from transform.recurrence_plot import RP
-from transform.markov_transition_field import MTF
+from labels.trading_strategies import local_min_max, local_min_max_sweep, labelled_frame, LABEL_NAMES
+from transform.multi_transform import multi_transform_batch
 
 
 def data_to_labelled_img(data, column_name, label_window_size, image_window_size, image_trf_strat, 
@@ -17,7 +18,9 @@ def data_to_labelled_img(data, column_name, label_window_size, image_window_size
                          standardize_out_RP=False, 
                          standardize_out_GASF = False, 
                          standardize_out_GADF = False,
-                         use_returns = False
+                         use_returns = False,
+                         dtype = np.float64,
+                         image_size = None
                          ):
     """Turns data into series of images with labels according to a trading strategy. 
     The output images can be from multiple strategies at the same time.
@@ -31,22 +34,25 @@ def data_to_labelled_img(data, column_name, label_window_size, image_window_size
         column_name : str
             name of column in df to transform
 
-        label_window_size : int 
-            the window size for data labelling (needs to be odd, should be smaller than length of series)
+        label_window_size : int or list of int
+            the window size for data labelling (needs to be odd, should be smaller than length of series);
+            with a list of window sizes the labels of all of them are computed in one pass and aligned to the same images
+            (the images of the largest window size, image_labels then has one set of labels per window size)
         
         image_window_size : int
             the window size for image creation (should be smaller than length of series, but more than half of the label window size)
             (please note that the TP transformation will result in images of size (image_window_size-1, image_window_size-1))
 
-        image_trf_strat : string or list of strings ('GASF', 'GADF', 'RP', 'MTF')
-            the image transformation strategy, either 'GASF', 'GADF', 'RP' or 'MTF'
+        image_trf_strat : string or list of strings ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new')
+            the image transformation strategy, either 'GASF', 'GADF', 'RP', 'MTF' or 'MTF_new'
             'GASF' - Gramian Angular Summation Field
             'GADF' - Gramian Angular Difference Field
             'RP' - Recurrence Plot
-            'MTF' - Markov Transition Field.
+            'MTF' - Markov Transition Field
+            'MTF_new' - multi-step Markov Transition Field (transitions to later states in as many steps as they are apart).
         
         num_bin : int (default = 5)
-            if image_trf_strat is 'MTF' num_bin determines the number of bins (by quantiles) to create per images in the MTF algorithm
+            if image_trf_strat is 'MTF' or 'MTF_new' num_bin determines the number of bins (by quantiles) to create per images in the MTF algorithm
             Default is 5.
 
         padding_RP :  int (default = 0)
@@ -64,10 +70,17 @@ def data_to_labelled_img(data, column_name, label_window_size, image_window_size
         use_returns : bool (default = False)
             whether the returns should be used for image creation instead of the prices
 
+        dtype : numpy dtype (default = np.float64)
+            type of the images: float64, float32, float16 or uint8 (quantized, see quantization in Returns)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before the
+            transformations, the images are then (image_size, image_size) instead of (image_window_size, image_window_size)
+
     Returns
     -----------------------------------------
         labelled_pd : pd.dataframe
-            data with new column of labels
+            data with new column of labels (a Strategy_<window size> column per window size for a list of label_window_size)
         
         price_at_image : np.array
             the last price used to create an image (the price one would trade at given the order implied by the image)
@@ -76,94 +89,327 @@ def data_to_labelled_img(data, column_name, label_window_size, image_window_size
             array of transformed matrices according to transformation setting
         
         image_labels : np.array
-            array of labels for each image, with one-hot encoding ("Sell", "Buy", "Hold" order for columns is default)
+            array of labels for each image, with one-hot encoding ("Sell", "Buy", "Hold" order for columns is default),
+            of shape (n_images, 3), or (len(label_window_size), n_images, 3) for a list of label_window_size
         
         label_names :
             dictionary linking strategy name to column index in image_labels ("Sell", "Buy", "Hold" order is default)
 
+        quantization : dict (only returned if dtype is uint8)
+            (scale, offset) of each transformation, image values ~ uint8 values * scale + offset
+
     """
-    if image_window_size < np.ceil(label_window_size/2):
+    if image_window_size < np.ceil(np.max(label_window_size)/2):
         print('image_window_size must be >= np.ceil(label_window_size/2), please choose a grater image window size.')
         return()
     else:    
-        series = np.array(data[column_name].values)
-        labelled_np, labelled_pd, ws, original = local_min_max(
-            series, label_window_size)
-
-        # get one-hot encoding for the labels
-        dummies = pd.get_dummies(labelled_pd.Strategy)
-        dummies = dummies[['Sell', 'Buy', 'Hold']]
-        # for saving which column is which
-        label_colnames = np.array(dummies.columns)
-
-        if use_returns == True:
-            ## if returns are used for image creation the first label we need is one step later (first return is nan)
-            image_labels = np.array(dummies)[
-                image_window_size:(-np.int(label_window_size/2)), :]
-
-            price_at_image = np.array(labelled_pd.Series.values)[
-                image_window_size:(-np.int(label_window_size/2))].reshape((-1,1))
-        else:
-            ## if prices used for image creation the first label is needed 1 step earlier
-            image_labels = np.array(dummies)[
-                (image_window_size-1):(-np.int(label_window_size/2)), :]
-            
-            price_at_image = np.array(labelled_pd.Series.values)[
-                (image_window_size-1):(-np.int(label_window_size/2))].reshape((-1, 1))
-        
-        if use_returns == True:
-            return_series = series[1:]/series[:-1] -1
-            series = return_series
-
-        # images from first datapoint to (last_idx - floor(label_window_size/2))
-        if "GASF" in image_trf_strat:
-            # transformation
-            images_GASF,  phi_GASF, r_GASF, scaled_ts_GASF, ts_GASF = GASF(
-                series[:-np.int(label_window_size/2)], image_window_size, standardize_out=standardize_out_GASF)
-            images_GASF = np.array(images_GASF)
-        
-        if "GADF" in image_trf_strat:
-            # transformation
-            images_GADF,  phi_GADF, r_GADF, scaled_ts_GADF, ts_GADF = GADF(
-                series[:-np.int(label_window_size/2)], image_window_size, standardize_out=standardize_out_GADF)
-            images_GADF = np.array(images_GADF)
-
-        if 'RP' in image_trf_strat:
-            # transformation
-            images_RP, serie_RP = RP(
-                series[:-np.int(label_window_size/2)], image_window_size, padding = padding_RP, standardize_out = standardize_out_RP)
-            images_RP = np.array(images_RP)
-
-        if 'MTF' in image_trf_strat:
-            #transformation
-            images_MTF, binned_serie_MTF, serie_MTF = MTF(
-                series[:-np.int(label_window_size/2)], window_size = image_window_size, num_bin = num_bin)
-            images_MTF = np.array(images_MTF)
-
-        if len(image_trf_strat)==0:
-            print('Please define the image_trf_strat: GASF, GADF, RP or MTF')
+        labelled_pd, price_at_image, image_labels, label_names, series = labels_and_image_series(
+            data, column_name, label_window_size, image_window_size, use_returns=use_returns)
+
+        # requested transformations as a list (a single one can be given as a string)
+        trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+
+        if len(trf_list)==0:
+            print('Please define the image_trf_strat: GASF, GADF, RP, MTF or MTF_new')
             return()
 
-        # Label names (as column name for image labels) 
-        
-        label_names = {np.int(np.argwhere(label_colnames == "Sell")) : "Sell",
-                       np.int(np.argwhere(label_colnames == "Buy")) : "Buy",
-                       np.int(np.argwhere(label_colnames == "Hold")) : "Hold"
-                        }
-        
-        if (type(image_trf_strat) == list) & (len(image_trf_strat) > 1):
-            
-            images = []
-            for trf in image_trf_strat:
-                images.append(eval("images_" + trf))
-            
-            # channels last representation
-            images = np.moveaxis(images, 0, -1)
-
-        else:
-            images = eval("images_" + image_trf_strat)
-
-        return(labelled_pd, price_at_image, np.array(images), image_labels, label_names)
+        n_images = len(series) - image_window_size + 1
+        if n_images < 1:
+            print('Image window size should not exceed the length of the data.')
+            return()
+
+        # one array for all images, channels last (a single transformation given as a string has no channel axis)
+        images = np.empty((n_images,) + image_shape(image_trf_strat, image_window_size, padding_RP, image_size), dtype=dtype)
+
+        # all channels computed in one pass over the windows
+        result = multi_transform_batch(series, image_window_size, trf_list,
+                                       num_bin=num_bin,
+                                       padding_RP=padding_RP,
+                                       standardize_out_RP=standardize_out_RP,
+                                       standardize_out_GASF=standardize_out_GASF,
+                                       standardize_out_GADF=standardize_out_GADF,
+                                       dtype=dtype,
+                                       out=image_channels(image_trf_strat, images),
+                                       image_size=image_size)
+
+        # uint8 images come with the (scale, offset) of each transformation
+        if np.dtype(dtype) == np.uint8:
+            return(labelled_pd, price_at_image, images, image_labels, label_names, result[1])
+        return(labelled_pd, price_at_image, images, image_labels, label_names)
+
+
+def labels_and_image_series(data, column_name, label_window_size, image_window_size, use_returns=False, labels=None):
+    """Labels of the images of data_to_labelled_img and the series the images are created from (without the images).
+
+    Parameters
+    -------
+        data :  pandas (time) series
+            input data
+
+        column_name : str
+            name of column in df to transform
+
+        label_window_size : int or list of int
+            the window size for data labelling (needs to be odd, should be smaller than length of series),
+            or several window sizes (see data_to_labelled_img)
+
+        image_window_size : int
+            the window size for image creation
+
+        use_returns : bool (default = False)
+            whether the returns should be used for image creation instead of the prices
+
+        labels : np.array (default = None)
+            label codes of the series if already computed (local_min_max with labelled_output = False, or
+            local_min_max_sweep for a list of label_window_size)
+
+    Returns
+    -----------------------------------------
+        labelled_pd : pd.dataframe
+            data with new column of labels (one per window size for a list of label_window_size)
+
+        price_at_image : np.array
+            the last price used to create an image
+
+        image_labels : np.array
+            array of labels for each image, with one-hot encoding ("Sell", "Buy", "Hold" order for columns is default)
+            (one set per window size for a list of label_window_size)
+
+        label_names :
+            dictionary linking strategy name to column index in image_labels
+
+        series : np.array
+            prices (or returns) to create images from, image i is made of series[i:(i + image_window_size)]
+    """
+    series = np.array(data[column_name].values)
+    if np.ndim(label_window_size) == 0:
+        if labels is None:
+            labels = local_min_max(series, label_window_size, labelled_output=False)
+        labelled_pd = labelled_frame(series, labels)
+    else:
+        # labels of all window sizes in one pass, the images end where the labels of the largest window size end
+        if labels is None:
+            labels = local_min_max_sweep(series, label_window_size)
+        labelled_pd = labelled_frame(series, labels, window_sizes=label_window_size)
+        label_window_size = max(label_window_size)
+
+    # one-hot encoding of the labels, columns in code order ("Sell", "Buy", "Hold"), no column set where no label
+    one_hot = labels[..., np.newaxis] == np.arange(len(LABEL_NAMES))
+
+    if use_returns == True:
+        ## if returns are used for image creation the first label we need is one step later (first return is nan)
+        image_labels = one_hot[..., image_window_size:(-int(label_window_size/2)), :]
+
+        price_at_image = series[image_window_size:(-int(label_window_size/2))].reshape((-1,1))
+    else:
+        ## if prices used for image creation the first label is needed 1 step earlier
+        image_labels = one_hot[..., (image_window_size-1):(-int(label_window_size/2)), :]
+
+        price_at_image = series[(image_window_size-1):(-int(label_window_size/2))].reshape((-1, 1))
+
+    if use_returns == True:
+        return_series = series[1:]/series[:-1] -1
+        series = return_series
+
+    # Label names (as column name for image labels)
+    label_names = dict(LABEL_NAMES)
+
+    # images from first datapoint to (last_idx - floor(label_window_size/2))
+    return(labelled_pd, price_at_image, image_labels, label_names, series[:-int(label_window_size/2)])
+
+
+def image_shape(image_trf_strat, image_window_size, padding_RP=0, image_size=None):
+    """Shape of one image of data_to_labelled_img: (size, size, n_channels), or (size, size) if image_trf_strat is a string.
+    Raises an exception if the transformations give images of different sizes (RP images are (image_size-1+padding_RP) wide,
+    image_size is image_window_size if not defined)."""
+    trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+    if image_size == None:
+        image_size = image_window_size
+    sizes = [image_size - 1 + padding_RP if trf == 'RP' else image_size for trf in trf_list]
+    if len(set(sizes)) > 1:
+        raise Exception('All transformations should give images of the same size, got ' + str(dict(zip(trf_list, sizes)))
+                        + ' (set padding_RP = 1 to combine RP with the other transformations).')
+
+    if isinstance(image_trf_strat, str):
+        return((sizes[0], sizes[0]))
+    return((sizes[0], sizes[0], len(trf_list)))
+
+
+def image_channels(image_trf_strat, images):
+    """images as a channels-last array (a channel axis is added if image_trf_strat is a string)."""
+    if isinstance(image_trf_strat, str):
+        return(images[..., np.newaxis])
+    return(images)
+
+
+def build_labelled_images(assets, label_window_size, image_window_size, image_trf_strat,
+                          num_bin=5,
+                          padding_RP=0,
+                          standardize_out_RP=False,
+                          standardize_out_GASF=False,
+                          standardize_out_GADF=False,
+                          use_returns=False,
+                          dtype=np.float64,
+                          image_size=None,
+                          n_jobs=None,
+                          chunk_windows=8192):
+    """Labelled images of several assets (data_to_labelled_img of each), built on a process pool.
+    The assets, and chunks of windows of long assets, are spread over the worker processes. Each task writes its images
+    into its own shared memory block, which is copied to the position of the asset and chunk in the result when the task
+    is done and then released. At most two tasks per worker are in flight, so the peak memory is about the result plus
+    those blocks.
+
+    Parameters
+    -------
+        assets : list of (str, pandas series) tuples
+            name and cleaned price series (or one-column frame) of each asset (e.g. univar_ts output)
+
+        label_window_size, image_window_size, image_trf_strat, num_bin, padding_RP, standardize_out_RP,
+        standardize_out_GASF, standardize_out_GADF, use_returns, dtype, image_size :
+            same as in data_to_labelled_img
+
+        n_jobs : int (default = None)
+            number of worker processes (all cores if not defined, 1 computes everything in this process)
+
+        chunk_windows : int (default = 8192)
+            number of windows per task (assets with more windows are split)
+
+    Returns
+    -----------------------------------------
+        images : np.array
+            images of all assets, one asset after the other in the order of assets
+
+        image_labels : np.array
+            one-hot labels of all images ("Sell", "Buy", "Hold" order for columns is default)
+            (of shape (n_sizes, n_images, 3) for a list of label_window_size)
+
+        price_at_image : np.array
+            the last price used to create each image
+
+        label_names :
+            dictionary linking strategy name to column index in image_labels
+
+        asset_rows : dict
+            name of each asset : (first row, last row + 1) of its images
+
+        quantization : dict (only returned if dtype is uint8)
+            name of each asset : (scale, offset) of each transformation, image values ~ uint8 values * scale + offset
+    """
+    if image_window_size < np.ceil(np.max(label_window_size)/2):
+        print('image_window_size must be >= np.ceil(label_window_size/2), please choose a grater image window size.')
+        return()
+
+    trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+    shape = image_shape(image_trf_strat, image_window_size, padding_RP, image_size)
+    transform_params = dict(num_bin=num_bin,
+                            padding_RP=padding_RP,
+                            standardize_out_RP=standardize_out_RP,
+                            standardize_out_GASF=standardize_out_GASF,
+                            standardize_out_GADF=standardize_out_GADF,
+                            dtype=dtype,
+                            image_size=image_size)
+
+    # labels and series to transform, per asset (cheap, done here)
+    names, series_list, image_labels, price_at_image = [], [], [], []
+    for name, data in assets:
+        # a series or a one-column frame (create_cleaned_set output)
+        data = np.asarray(data, dtype=np.float64)
+        if (data.ndim > 1) and (data.size != data.shape[0]):
+            raise Exception('The data of ' + str(name) + ' should be a series or a frame with one column.')
+        labelled_pd, prices, labels, label_names, series = labels_and_image_series(
+            pd.DataFrame({name: data.reshape(-1)}), name, label_window_size, image_window_size, use_returns=use_returns)
+        names.append(name)
+        series_list.append(series)
+        image_labels.append(labels)
+        price_at_image.append(prices)
+
+    # labels of a list of label_window_size have a first axis of window sizes
+    n_images = [labels.shape[-2] for labels in image_labels]
+    first_rows = np.concatenate(([0], np.cumsum(n_images)))
+    asset_rows = {name: (int(first_rows[a]), int(first_rows[a + 1])) for a, name in enumerate(names)}
+
+    # the uint8 range of raw RP images depends on the windows, such assets are transformed in one piece
+    # (same quantization as data_to_labelled_img)
+    split = not ((np.dtype(dtype) == np.uint8) and ('RP' in trf_list) and (standardize_out_RP != True))
+
+    # tasks: (asset, first window, last window + 1)
+    tasks = []
+    for a, n in enumerate(n_images):
+        step = chunk_windows if split else max(n, 1)
+        tasks += [(a, start, min(start + step, n)) for start in range(0, n, step)]
+
+    images = np.empty((int(first_rows[-1]),) + shape, dtype=dtype)
+    if n_jobs == 1:
+        results = [_transform_rows(images, first_rows[a] + start, series_list[a][start:(end + image_window_size - 1)],
+                                   image_window_size, image_trf_strat, transform_params) for a, start, end in tasks]
+    else:
+        results = [None] * len(tasks)
+        max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+        # (task, first row, number of rows, shared memory block, future) of the submitted tasks, collected in order
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                for t, (a, start, end) in enumerate(tasks):
+                    if len(pending) == max_pending:
+                        _collect_shared_rows(images, results, *pending.popleft())
+                    block_shape = (end - start,) + shape
+                    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(block_shape)) * images.itemsize, 1))
+                    pending.append((t, first_rows[a] + start, end - start, shm,
+                                    executor.submit(_transform_shared_rows, shm.name, block_shape, dtype,
+                                                    series_list[a][start:(end + image_window_size - 1)],
+                                                    image_window_size, image_trf_strat, transform_params)))
+                while len(pending) > 0:
+                    _collect_shared_rows(images, results, *pending.popleft())
+        finally:
+            for t, first_row, n_rows, shm, future in pending:
+                shm.close()
+                shm.unlink()
+
+    image_labels = np.concatenate(image_labels, axis=-2)
+    price_at_image = np.concatenate(price_at_image)
+
+    if np.dtype(dtype) == np.uint8:
+        quantization = {names[a]: quant for (a, start, end), quant in zip(tasks, results)}
+        return(images, image_labels, price_at_image, label_names, asset_rows, quantization)
+    return(images, image_labels, price_at_image, label_names, asset_rows)
+
+
+def _transform_rows(images, first_row, series, image_window_size, image_trf_strat, transform_params):
+    """Write the images of every window of series into images, from row first_row on (one task of build_labelled_images).
+    Returns the quantization of the transformations for uint8 images, None otherwise."""
+    trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+    n_rows = len(series) - image_window_size + 1
+    result = multi_transform_batch(series, image_window_size, trf_list,
+                                   out=image_channels(image_trf_strat, images[first_row:(first_row + n_rows)]),
+                                   **transform_params)
+    return(result[1] if isinstance(result, tuple) else None)
+
+
+def _transform_shared_rows(shm_name, shape, dtype, series, image_window_size, image_trf_strat, transform_params):
+    """_transform_rows in a worker process, writing into the shared memory block shm_name of the task (no images are
+    sent back)."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        images = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = _transform_rows(images, 0, series, image_window_size, image_trf_strat, transform_params)
+        del images
+    finally:
+        shm.close()
+    return(result)
+
+
+def _collect_shared_rows(images, results, task, first_row, n_rows, shm, future):
+    """Copy the images of a finished task from its shared memory block into images (from row first_row on) and release
+    the block."""
+    try:
+        results[task] = future.result()
+        block = np.ndarray((n_rows,) + images.shape[1:], dtype=images.dtype, buffer=shm.buf)
+        images[first_row:(first_row + n_rows)] = block
+        del block
+    finally:
+        shm.close()
+        shm.unlink()
+
 
 if __name__ == "__main__":
     dta = pd.DataFrame(data=np.array(np.random.normal(0, 2.3, 40)), columns=["Series"])
@@ -0,0 +1,181 @@
+import pandas as pd
+import numpy as np
+
+from labels.trading_strategies import SELL, BUY, HOLD, NO_LABEL
+
+
+## Technical indicators (as in the ta library 0.4, used by the competing strategies notebook)
+def rsi(prices, window=20):
+    """Relative Strength Index of each series: 100 * ema(up moves) / (ema(up moves) + ema(down moves)), with
+    exponential moving averages of span window (nan for the first window values).
+
+    Parameters
+    ---------------------------------------
+        prices : np.array of shape (n_steps,) or (n_assets, n_steps)
+            price series (one per row)
+
+        window : int (default = 20)
+            span of the moving averages
+
+    Return
+    ---------------------------------------
+        rsi : np.array (float64), same shape as prices
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    # columns of a DataFrame: the pandas operations run over all the assets at once
+    diff = pd.DataFrame(np.atleast_2d(prices).T).diff(1)
+    which_dn = diff < 0
+    up = diff.mask(which_dn, 0)
+    dn = (diff*0).mask(which_dn, -diff)
+
+    emaup = up.ewm(span=window, min_periods=window).mean()
+    emadn = dn.ewm(span=window, min_periods=window).mean()
+    result = (100 * emaup / (emaup + emadn)).to_numpy().T
+    return result.reshape(prices.shape)
+
+
+def bollinger_indicators(prices, window=20, ndev=2):
+    """Whether each price is above the upper / below the lower Bollinger band (moving average +/- ndev moving standard
+    deviations of the last window prices; False for the first window - 1 prices).
+
+    Parameters
+    ---------------------------------------
+        prices : np.array of shape (n_steps,) or (n_assets, n_steps)
+            price series (one per row)
+
+        window : int (default = 20)
+            number of prices of the moving average and standard deviation
+
+        ndev : float or list of floats (default = 2)
+            width of the bands in standard deviations (a list gives the indicators of each width, sharing the moving
+            average and standard deviation)
+
+    Return
+    ---------------------------------------
+        high, low : np.array (bool), same shape as prices (with a first axis of len(ndev) for a list of ndev)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    close = pd.DataFrame(np.atleast_2d(prices).T)
+    mavg = close.rolling(window).mean().to_numpy().T.reshape(prices.shape)
+    mstd = close.rolling(window).std().to_numpy().T.reshape(prices.shape)
+
+    high = np.stack([prices > mavg + k*mstd for k in np.atleast_1d(ndev)])
+    low = np.stack([prices < mavg - k*mstd for k in np.atleast_1d(ndev)])
+    if np.ndim(ndev) == 0:
+        return(high[0], low[0])
+    return(high, low)
+
+
+## Signals of the competing strategies
+def rsi_signals(prices, window=20, lower=30, upper=70, rsi_values=None):
+    """RSI strategy signals as label codes: Buy when the RSI crosses the lower line from below, Sell when it crosses the
+    upper line from above (the RSI is strictly between the lines and was at or beyond the line the step before),
+    otherwise Hold; the first step has no signal (NO_LABEL).
+
+    Parameters
+    ---------------------------------------
+        prices : np.array of shape (n_steps,) or (n_assets, n_steps)
+            price series (one per row)
+
+        window : int (default = 20)
+            window of the RSI
+
+        lower, upper : float (default = 30, 70)
+            lines of the RSI
+
+        rsi_values : np.array (default = None)
+            RSI of prices with the given window, if already computed
+
+    Return
+    ---------------------------------------
+        signals : np.array (int8), same shape as prices
+            SELL = 0, BUY = 1, HOLD = 2, NO_LABEL = -1 (as labels.trading_strategies)
+    """
+    values = rsi(prices, window) if rsi_values is None else rsi_values
+    current, previous = values[..., 1:], values[..., :-1]
+
+    signals = np.full(values.shape, HOLD, dtype=np.int8)
+    signals[..., 0] = NO_LABEL
+    between = (current > lower) & (current < upper)
+    signals[..., 1:][between & (previous <= lower)] = BUY
+    signals[..., 1:][between & ~(previous <= lower) & (previous >= upper)] = SELL
+    return(signals)
+
+
+def bollinger_signals(prices, window=20, ndev=2):
+    """Bollinger bands strategy signals as label codes: Sell above the upper band, Buy below the lower band,
+    otherwise Hold.
+
+    Parameters
+    ---------------------------------------
+        prices, window, ndev :
+            same as in bollinger_indicators
+
+    Return
+    ---------------------------------------
+        signals : np.array (int8), same shape as the indicators
+            SELL = 0, BUY = 1, HOLD = 2 (as labels.trading_strategies)
+    """
+    high, low = bollinger_indicators(prices, window, ndev)
+    return(np.where(low, BUY, np.where(high, SELL, HOLD)).astype(np.int8))
+
+
+def competing_signals(prices, rsi_settings=((20, 30, 70),), bollinger_settings=((20, 2),)):
+    """Signals of the RSI and Bollinger bands strategies of many assets for many settings in one call.
+    The RSI of each window, and the moving average and standard deviation of each Bollinger window, are computed
+    once (over all the assets together) and shared by the settings using them.
+
+    Parameters
+    ---------------------------------------
+        prices : np.array of shape (n_assets, n_steps)
+            price series (one per row)
+
+        rsi_settings : list of (window, lower, upper) tuples (default = [(20, 30, 70)])
+            settings of the RSI strategy
+
+        bollinger_settings : list of (window, ndev) tuples (default = [(20, 2)])
+            settings of the Bollinger bands strategy
+
+    Return
+    ---------------------------------------
+        settings : pd.DataFrame
+            strategy ('RSI' or 'BB') and parameters (window, lower, upper, ndev) of each setting
+
+        signals : np.array (int8) of shape (n_settings, n_assets, n_steps)
+            signals of each setting (label codes, see rsi_signals and bollinger_signals), to be used e.g. as
+            signals.reshape(-1, n_steps) in batch_financial_evaluation
+    """
+    prices = np.atleast_2d(np.asarray(prices, dtype=np.float64))
+    rsi_settings = [tuple(setting) for setting in rsi_settings]
+    bollinger_settings = [tuple(setting) for setting in bollinger_settings]
+
+    signals = np.empty((len(rsi_settings) + len(bollinger_settings),) + prices.shape, dtype=np.int8)
+
+    for window in sorted(set(setting[0] for setting in rsi_settings)):
+        values = rsi(prices, window)
+        for s, (window_s, lower, upper) in enumerate(rsi_settings):
+            if window_s == window:
+                signals[s] = rsi_signals(prices, window, lower, upper, rsi_values=values)
+
+    for window in sorted(set(setting[0] for setting in bollinger_settings)):
+        rows = [s for s, setting in enumerate(bollinger_settings) if setting[0] == window]
+        ndevs = [bollinger_settings[s][1] for s in rows]
+        high, low = bollinger_indicators(prices, window, ndevs)
+        for i, s in enumerate(rows):
+            signals[len(rsi_settings) + s] = np.where(low[i], BUY, np.where(high[i], SELL, HOLD))
+
+    settings = pd.DataFrame({'strategy': ['RSI'] * len(rsi_settings) + ['BB'] * len(bollinger_settings),
+                             'window': [setting[0] for setting in rsi_settings + bollinger_settings],
+                             'lower': [setting[1] for setting in rsi_settings] + [np.nan] * len(bollinger_settings),
+                             'upper': [setting[2] for setting in rsi_settings] + [np.nan] * len(bollinger_settings),
+                             'ndev': [np.nan] * len(rsi_settings) + [setting[1] for setting in bollinger_settings]})
+    return(settings, signals)
+
+
+if __name__ == "__main__":
+    prices = np.cumsum(np.random.normal(0, 1, (3, 500)), axis=1) + 100
+
+    settings, signals = competing_signals(prices, rsi_settings=[(14, 30, 70), (20, 30, 70), (20, 20, 80)],
+                                          bollinger_settings=[(20, 2), (20, 1.5), (50, 2)])
+    print(settings)
+    print(signals.shape, [np.bincount(s.reshape(-1) + 1) for s in signals])
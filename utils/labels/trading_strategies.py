@@ -1,8 +1,149 @@
 import pandas as pd
 import numpy as np
 
+# Integer codes of the labels (the column order of the one-hot image labels), -1 where no label can be assigned
+SELL, BUY, HOLD, NO_LABEL = 0, 1, 2, -1
+LABEL_NAMES = {SELL: 'Sell', BUY: 'Buy', HOLD: 'Hold'}
+
+
+## Sliding minimum and maximum
+def sliding_min_max(serie, window_size):
+    """Minimum and maximum of every sliding window of a series in O(N), independently of the window size
+    (van Herk / Gil-Werman: running minimums / maximums forward and backward inside blocks of window_size values,
+    every window is covered by the end of one block and the start of the next).
+    nan values propagate to the windows containing them, as with np.amin / np.amax.
+
+    Parameters
+    ---------------------------------------
+        serie : np.array
+            input series
+
+        window_size : int
+            size of the windows
+
+    Return
+    ---------------------------------------
+        window_min, window_max : np.array
+            minimum and maximum of serie[i:(i + window_size)], for i in 0, ..., len(serie) - window_size
+    """
+    serie = np.asarray(serie).reshape(-1)
+    n_windows = len(serie) - window_size + 1
+    if n_windows < 1:
+        return(serie[:0], serie[:0])
+
+    # series padded to whole blocks (the padding is only ever compared within windows past the end)
+    n_blocks = -(-len(serie) // window_size)
+    blocks = np.pad(serie, (0, n_blocks * window_size - len(serie)), mode='edge').reshape(n_blocks, window_size)
+
+    result = []
+    for extremum in (np.minimum, np.maximum):
+        # running value from the start of each block, and from each value to the end of its block
+        forward = extremum.accumulate(blocks, axis=1).reshape(-1)
+        backward = extremum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+        # window i spans backward[i] (to the end of its block) and forward[i + window_size - 1] (from the next block start)
+        result.append(extremum(backward[:n_windows], forward[(window_size - 1):(window_size - 1 + n_windows)]))
+    return(result[0], result[1])
+
+
 ## Local mins and max-es
-def local_min_max(serie, window_size):
+def local_min_max_codes(serie, window_size):
+    """Labels of local_min_max as integer codes (SELL = 0, BUY = 1, HOLD = 2, NO_LABEL = -1 for the first and last
+    window_size // 2 values), computed with sliding minimum / maximum filters in O(N).
+
+    Parameters
+    ---------------------------------------
+        serie :  np.array
+            input series
+
+        window_size : int (must be odd)
+            size of window to use for labelling, must be odd
+
+    Return
+    ---------------------------------------
+        labels : np.array of type int8
+            code of the label of each value of serie
+    """
+    if window_size % 2 != 1:
+        raise Exception('Please define an odd window_size!')
+
+    serie = np.asarray(serie).reshape(-1)
+    labels = np.full(len(serie), NO_LABEL, dtype=np.int8)
+
+    # (a window of one value labels nothing, there is no next value to compare with at the end)
+    n_windows = len(serie) - window_size + 1
+    if (window_size == 1) or (n_windows < 1):
+        return(labels)
+
+    window_min, window_max = sliding_min_max(serie, window_size)
+    _assign_labels(serie, labels, window_size, window_min, window_max)
+    return(labels)
+
+
+def local_min_max_sweep(serie, window_sizes):
+    """Labels of local_min_max_codes for several window sizes in one pass over the series.
+    The window sizes are processed from the smallest to the largest, the minimums / maximums of a window size being
+    combined from the ones of the previous size (two overlapping smaller windows cover a larger one), so each further
+    size costs one elementwise minimum and maximum; a size more than about twice the previous one starts a new
+    sliding_min_max.
+
+    Parameters
+    ---------------------------------------
+        serie :  np.array
+            input series
+
+        window_sizes : list of int (must be odd)
+            sizes of window to use for labelling
+
+    Return
+    ---------------------------------------
+        labels : np.array of type int8 and shape (len(window_sizes), len(serie))
+            code of the label of each value of serie, one row per window size (in the order of window_sizes)
+    """
+    window_sizes = [int(window_size) for window_size in window_sizes]
+    for window_size in window_sizes:
+        if window_size % 2 != 1:
+            raise Exception('Please define odd window sizes, got ' + str(window_size) + '!')
+
+    serie = np.asarray(serie).reshape(-1)
+    labels = np.full((len(window_sizes), len(serie)), NO_LABEL, dtype=np.int8)
+
+    # minimums / maximums of the windows of the last size computed, centred at radius, ..., len(serie) - 1 - radius
+    radius = None
+    window_min = window_max = None
+    for window_size in sorted(set(window_sizes)):
+        new_radius = int((window_size - 1)/2)
+        if (window_size == 1) or (len(serie) < window_size):
+            continue
+
+        step = new_radius - radius if radius is not None else None
+        if (step is not None) and (step <= radius):
+            # windows centred step before and step after (of the previous radius) cover the window without gap
+            window_min = np.minimum(window_min[:(-2*step)], window_min[(2*step):])
+            window_max = np.maximum(window_max[:(-2*step)], window_max[(2*step):])
+        else:
+            window_min, window_max = sliding_min_max(serie, window_size)
+        radius = new_radius
+
+        for row in np.flatnonzero(np.array(window_sizes) == window_size):
+            _assign_labels(serie, labels[row], window_size, window_min, window_max)
+    return(labels)
+
+
+def _assign_labels(serie, labels, window_size, window_min, window_max):
+    """Label codes of the window centres written into labels, from the minimum / maximum of each window."""
+    mid_idx = int((window_size - 1)/2)
+    n_windows = len(window_min)
+    mid = serie[mid_idx:(mid_idx + n_windows)]
+    following = serie[(mid_idx + 1):(mid_idx + 1 + n_windows)]
+
+    # if mid is the minimum, and the next value is strictly greater than the mid (so for constant series nothing is buy),
+    # if mid is the maximum, and the next value is strictly smaller than the mid (so for constant series nothing is sell)
+    buy = (window_min == mid) & (mid < following)
+    sell = (window_max == mid) & (mid > following) & ~buy
+    labels[mid_idx:(mid_idx + n_windows)] = np.where(buy, BUY, np.where(sell, SELL, HOLD))
+
+
+def local_min_max(serie, window_size, labelled_output=True):
     """Determines local minimums and maximums in odd sized sliding widows and labels the data accordingly.
         For price at local max: Sell,
         For price at local min: Buy,
@@ -14,6 +155,10 @@ def local_min_max(serie, window_size):
             
             window_size : int (must be odd)
                 size of window to use for labelling, must be odd
+
+            labelled_output : bool (default = True)
+                whether the numpy (string) and pandas outputs should be created, otherwise only the label codes
+                of local_min_max_codes are returned
             
         Return
         ---------------------------------------
@@ -28,42 +173,43 @@ def local_min_max(serie, window_size):
 
             original : np.array
                 orignal input series
+
+            (labels : np.array of type int8, instead of the above if labelled_output is False)
     """
 
     if window_size % 2 ==1:
-        ## Technical arrays, variables
-        index_set = np.arange(len(serie))
-        window_size_use = window_size - 1
-
-        ## For the labels
-        label = np.empty(serie.shape, dtype = "S10")
-        label[:] = 'None'
+        labels = local_min_max_codes(serie, window_size)
+        if labelled_output != True:
+            return(labels)
 
-        mid_idx = int(window_size_use/2)
-        for idx in index_set[:-window_size_use]:
-            
-            if (np.amin(serie[idx:(idx + window_size)]) == serie[idx + mid_idx]) & (serie[idx + mid_idx] < serie[idx + mid_idx + 1]):
-                # if mid is the minimum, and the next idx after the mid is strictly greater than the mid (so for constant series nothing is buy)
-                label[idx + mid_idx] = 'Buy' 
-            elif (np.amax(serie[idx:(idx + window_size)]) == serie[idx + mid_idx]) & (serie[idx + mid_idx] > serie[idx + mid_idx + 1]):
-                # if mid is the maximum, and the next idx after the mid is strictly smaller than the mid (so for constant series nothing is sell)
-                label[idx + mid_idx] = 'Sell'
-            else:
-                label[idx + mid_idx] = 'Hold'
-        
-        # numpy output
+        # numpy output (code -1, no label, indexes the last name)
+        label = np.array([b'Sell', b'Buy', b'Hold', b'None'], dtype='S10')[labels]
         serie_labelled_np = np.array((serie, label)).transpose().reshape(-1,2)
 
         # pandas output
-        serie_labelled_pd = pd.DataFrame(data={'Series': serie, 'Strategy': label})
-        serie_labelled_pd ['Strategy'] = serie_labelled_pd['Strategy'].str.decode('utf-8')
-        serie_labelled_pd.loc[serie_labelled_pd['Strategy'] == 'None', 'Strategy'] = None
+        serie_labelled_pd = labelled_frame(serie, labels)
 
         return(serie_labelled_np, serie_labelled_pd, window_size, serie)
     else: 
         print('Please define an odd window_size!')
         return(False, window_size, serie)
-        
+
+
+def labelled_frame(serie, labels, window_sizes=None):
+    """pandas output of local_min_max (Series and Strategy columns, None where no label) from the label codes.
+    For the labels of local_min_max_sweep (one row per window size in window_sizes) there is a Strategy_<window size>
+    column per window size."""
+    if window_sizes is None:
+        labels, columns = labels[np.newaxis], ['Strategy']
+    else:
+        columns = ['Strategy_' + str(window_size) for window_size in window_sizes]
+
+    serie_labelled_pd = pd.DataFrame(data={'Series': serie})
+    for column, row in zip(columns, labels):
+        serie_labelled_pd[column] = np.array(['Sell', 'Buy', 'Hold', 'None'], dtype=object)[row]
+        serie_labelled_pd.loc[row == NO_LABEL, column] = None
+    return(serie_labelled_pd)
+
 if __name__ == "__main__":
     
     labelled_np, labelled_pandas, ws, original = local_min_max(np.array([1, 223, 3.6, 3, 6, 7, 87, 312, .34,.2, 3]), window_size = 3)
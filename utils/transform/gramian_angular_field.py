@@ -5,8 +5,10 @@ import numpy as np
 from sklearn.preprocessing import MinMaxScaler
 import matplotlib.pyplot as plt 
 
+from transform.window_ops import sliding_windows, paa, minmax_scale, work_dtype, to_image_dtype, check_float_dtype, uint8_scale, output_array, work_buffer
+
 # Gramian Angular Summation Field transformation for various window size in time series
-def GASF(serie, window_size=None, standardize_out = False):
+def GASF(serie, window_size=None, standardize_out = False, dtype = np.float64):
     """Compute the Gramian Angular Summation Field of a time series with sliding windows of size window_size if defined, if not defined one image is created.
     
     Parameters
@@ -20,6 +22,9 @@ def GASF(serie, window_size=None, standardize_out = False):
         standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from GASF_batch)
+
     Returns
     ------------------------
         gasfs : list of matrices of floats
@@ -42,7 +47,7 @@ def GASF(serie, window_size=None, standardize_out = False):
         print('Image window size should not exceed the length of the data.')
         return()
     elif window_size == len(serie):
-        return GASF_nowindow(serie, standardize_out=standardize_out)
+        return GASF_nowindow(serie, standardize_out=standardize_out, dtype=dtype)
     elif window_size != None:
         ## Technical arrays, variables
         serie2 = np.array(serie)
@@ -55,7 +60,7 @@ def GASF(serie, window_size=None, standardize_out = False):
 
         for idx in index_set:
             g, p, r, ss, ser = GASF_nowindow(
-                serie2[idx:(idx + window_size)], standardize_out=standardize_out)
+                serie2[idx:(idx + window_size)], standardize_out=standardize_out, dtype=dtype)
             gasfs.append(g)
             phis.append(p)
             rs.append(r)
@@ -64,10 +69,10 @@ def GASF(serie, window_size=None, standardize_out = False):
         return(gasfs, phis, rs, scaled_series, serie)
     else:
         print('No window size were defined, therefore the GASF is for the whole input series.')
-        return GASF_nowindow(serie, standardize_out=standardize_out)
+        return GASF_nowindow(serie, standardize_out=standardize_out, dtype=dtype)
 
 # Gramian Angular Summation Field transformation (for entire input series)
-def GASF_nowindow(serie, standardize_out = False):
+def GASF_nowindow(serie, standardize_out = False, dtype = np.float64):
     """Compute the Gramian Angular Summation Field of a time series (no PAA smoothing)
     
     Parameters
@@ -77,7 +82,10 @@ def GASF_nowindow(serie, standardize_out = False):
         
          standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
-    
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from GASF_batch)
+
     Returns
     ------------------------
         gasf :  matrix of floats
@@ -95,6 +103,8 @@ def GASF_nowindow(serie, standardize_out = False):
         serie: np.array
             original input serie (reshaped)
     """
+    check_float_dtype(dtype)
+
     # Right Array Type
     serie = np.array([serie]).reshape(-1, 1)
 
@@ -124,12 +134,64 @@ def GASF_nowindow(serie, standardize_out = False):
         gasf = np.where(gasf >= 1., 1., gasf)
         gasf = np.where(gasf <= 0., 0., gasf)
 
-    return(gasf, phi, r, scaled_serie, serie)
+    return(gasf.astype(dtype, copy=False), phi, r, scaled_serie, serie)
+
+
+# Gramian Angular Summation Field transformation for all sliding windows at once
+def GASF_batch(serie, window_size=None, standardize_out = False, dtype = np.float64, out = None, chunk_size = 4096, image_size = None):
+    """Compute the Gramian Angular Summation Field of every sliding window of a time series in one go (optionally PAA smoothed).
+    Gives the same matrices as calling GASF_nowindow on each window, but the scaling and the cos(a + b) terms
+    are computed as broadcasted array operations over all windows.
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to turn into GASF matrices
+
+        window_size :  int (default = None)
+            size of windows of time series to use as input for GASF matrices, if not defined one image is created
+
+        standardize_out : bool (default = False)
+            whether the resulting images should be standardized between 0 and 1 (minmax scaler)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 (computed in float32) or uint8 (quantized over the value range)
+
+        out : np.array (default = None)
+            array of shape (n_windows, image_size, image_size) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        chunk_size : int (default = 4096)
+            number of windows computed together (bounds the working memory when dtype is float16 or uint8)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the transformation (images of image_size x image_size instead of window_size x window_size)
+
+    Returns
+    ------------------------
+        gasfs : np.array of shape (n_windows, image_size, image_size)
+            matrices of transformed values for each window (GASF matrix)
+            for dtype uint8 a tuple of (quantized matrices, scale, offset), gasfs ~ quantized * scale + offset
+    """
+    phi = _windowed_phi(serie, window_size, dtype, image_size)
+    if phi is None:
+        return()
+
+    value_range = (0, 1) if standardize_out == True else (-1, 1)
+    gasfs = output_array(out, (phi.shape[0], phi.shape[1], phi.shape[1]), dtype)
+
+    for start in range(0, len(phi), chunk_size):
+        gaf_chunk(phi[start:(start + chunk_size)], gasfs[start:(start + chunk_size)], 'summation', standardize_out=standardize_out)
+
+    if np.dtype(dtype) == np.uint8:
+        return((gasfs,) + uint8_scale(value_range))
+    return(gasfs)
 
 
 
 # Gramian Angular Difference Field transformation for various window size in time series
-def GADF(serie, window_size=None, standardize_out = False):
+def GADF(serie, window_size=None, standardize_out = False, dtype = np.float64):
     """Compute the Gramian Angular Difference Field of a time series with sliding windows of size window_size if defined, if not defined one image is created.
     
     Parameters
@@ -143,6 +205,9 @@ def GADF(serie, window_size=None, standardize_out = False):
          standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from GADF_batch)
+
     Returns
     ------------------------
         gasfs : list of matrices of floats
@@ -165,7 +230,7 @@ def GADF(serie, window_size=None, standardize_out = False):
         print('Image window size should not exceed the length of the data.')
         return()
     elif window_size == len(serie):
-        return GADF_nowindow(serie, standardize_out=standardize_out)
+        return GADF_nowindow(serie, standardize_out=standardize_out, dtype=dtype)
     elif window_size != None:
         ## Technical arrays, variables
         serie2 = np.array(serie)
@@ -178,7 +243,7 @@ def GADF(serie, window_size=None, standardize_out = False):
 
         for idx in index_set:
             g, p, r, ss, ser = GADF_nowindow(
-                serie2[idx:(idx + window_size)], standardize_out=standardize_out)
+                serie2[idx:(idx + window_size)], standardize_out=standardize_out, dtype=dtype)
             gadfs.append(g)
             phis.append(p)
             rs.append(r)
@@ -188,10 +253,10 @@ def GADF(serie, window_size=None, standardize_out = False):
     else:
         print(
             'No window size were defined, therefore the GASF is for the whole input series.')
-        return GADF_nowindow(serie, standardize_out=standardize_out)
+        return GADF_nowindow(serie, standardize_out=standardize_out, dtype=dtype)
 
 # Gramian Angular Difference Field transformation (for entire input series)
-def GADF_nowindow(serie, standardize_out = False):
+def GADF_nowindow(serie, standardize_out = False, dtype = np.float64):
     """Compute the Gramian Angular Difference Field of a time series (no PAA smoothing)
 
     Parameters
@@ -201,7 +266,10 @@ def GADF_nowindow(serie, standardize_out = False):
         
          standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
-    
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from GADF_batch)
+
     Returns
     ------------------------
         gadf :  matrix of floats
@@ -220,6 +288,8 @@ def GADF_nowindow(serie, standardize_out = False):
             original input serie (reshaped)
     
     """
+    check_float_dtype(dtype)
+
     # Right Array Type
     serie = np.array([serie]).reshape(-1, 1)
 
@@ -249,10 +319,125 @@ def GADF_nowindow(serie, standardize_out = False):
         gadf = np.where(gadf >= 1., 1., gadf)
         gadf = np.where(gadf <= 0., 0., gadf)
 
-    return(gadf, phi, r, scaled_serie, serie)
+    return(gadf.astype(dtype, copy=False), phi, r, scaled_serie, serie)
+
+
+# Gramian Angular Difference Field transformation for all sliding windows at once
+def GADF_batch(serie, window_size=None, standardize_out = False, dtype = np.float64, out = None, chunk_size = 4096, image_size = None):
+    """Compute the Gramian Angular Difference Field of every sliding window of a time series in one go (optionally PAA smoothed).
+    Gives the same matrices as calling GADF_nowindow on each window, but the scaling and the sin(a - b) terms
+    are computed as broadcasted array operations over all windows.
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to turn into GADF matrices
+
+        window_size :  int (default = None)
+            size of windows of time series to use as input for GADF matrices, if not defined one image is created
+
+        standardize_out : bool (default = False)
+            whether the resulting images should be standardized between 0 and 1 (minmax scaler)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 (computed in float32) or uint8 (quantized over the value range)
+
+        out : np.array (default = None)
+            array of shape (n_windows, image_size, image_size) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        chunk_size : int (default = 4096)
+            number of windows computed together (bounds the working memory when dtype is float16 or uint8)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the transformation (images of image_size x image_size instead of window_size x window_size)
+
+    Returns
+    ------------------------
+        gadfs : np.array of shape (n_windows, image_size, image_size)
+            matrices of transformed values for each window (GADF matrix)
+            for dtype uint8 a tuple of (quantized matrices, scale, offset), gadfs ~ quantized * scale + offset
+    """
+    phi = _windowed_phi(serie, window_size, dtype, image_size)
+    if phi is None:
+        return()
+
+    value_range = (0, 1) if standardize_out == True else (-1, 1)
+    gadfs = output_array(out, (phi.shape[0], phi.shape[1], phi.shape[1]), dtype)
+
+    for start in range(0, len(phi), chunk_size):
+        gaf_chunk(phi[start:(start + chunk_size)], gadfs[start:(start + chunk_size)], 'difference', standardize_out=standardize_out)
+
+    if np.dtype(dtype) == np.uint8:
+        return((gadfs,) + uint8_scale(value_range))
+    return(gadfs)
+
 
 
 # Tools
+def _windowed_phi(serie, window_size, dtype=np.float64, image_size=None):
+    """Polar encoding (angles) of every sliding window (PAA reduced to image_size if defined), each window Min-Max scaled to [-1, 1] separately.
+    Returned in float64 for float64 output and in float32 otherwise (see polar_encoding).
+    Returns None if the window size exceeds the length of the series."""
+    if window_size == None:
+        window_size = len(serie)
+    elif len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return None
+
+    return(polar_encoding(paa(sliding_windows(serie, window_size), image_size), dtype))
+
+
+def polar_encoding(windows, dtype=np.float64, data_min=None, data_max=None):
+    """Angles of the windows (one per row), each window Min-Max scaled to [-1, 1] separately.
+    The scaling and arccos are computed in float64 (arccos loses precision near +-1 in float32), the angles are returned
+    in float64 for float64 output and in float32 otherwise.
+    data_min and data_max (shape (n_windows, 1)) can be given if the extremes of the windows are already known."""
+    scaled_windows = np.array(windows, dtype=np.float64)
+    minmax_scale(scaled_windows, feature_range=(-1, 1), axis=-1, out=scaled_windows, data_min=data_min, data_max=data_max)
+    np.arccos(scaled_windows, out=scaled_windows)
+    return(scaled_windows.astype(work_dtype(dtype), copy=False))
+
+
+def gaf_chunk(phi, target, kind, standardize_out=False, work=None):
+    """Write the GASF (kind = 'summation') or GADF (kind = 'difference') images of a chunk of windows into target.
+
+    Parameters
+    ------------------------
+        phi : np.array of shape (n_windows, window_size)
+            angles of the windows (see polar_encoding)
+
+        target : np.array of shape (n_windows, window_size, window_size)
+            array to write the images into, its dtype is the output dtype (uint8 quantized over the value range)
+
+        kind : str
+            'summation' (GASF) or 'difference' (GADF)
+
+        standardize_out : bool (default = False)
+            whether the resulting images should be standardized between 0 and 1 (minmax scaler)
+
+        work : np.array (default = None)
+            preallocated array of the shape of target and the type of phi to compute in
+    """
+    value_range = (0, 1) if standardize_out == True else (-1, 1)
+    images = work_buffer(target, phi.dtype, work)
+
+    # GAF Computation (cos(phi_j + phi_i) or sin(phi_j - phi_i) for every term of every matrix)
+    if kind == 'summation':
+        np.add(phi[:, np.newaxis, :], phi[:, :, np.newaxis], out=images)
+        np.cos(images, out=images)
+    else:
+        np.subtract(phi[:, np.newaxis, :], phi[:, :, np.newaxis], out=images)
+        np.sin(images, out=images)
+
+    if standardize_out == True:
+        # column-wise, as MinMaxScaler fitted on each matrix
+        minmax_scale(images, feature_range=(0, 1), axis=-2, out=images)
+
+    to_image_dtype(images, target.dtype, value_range, out=target)
+
+
 def tabulate(x, y, f):
     """Return a table of f(x, y). Useful for Gram-like operations."""
     return( np.vectorize(f)(*np.meshgrid(x, y, sparse = True))) #with vectorize execute function for all combinations, meshgrid to put it in table
@@ -1,10 +1,12 @@
 import math
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.preprocessing import KBinsDiscretizer
 import matplotlib.pyplot as plt
+from functools import lru_cache
 
-def MTF(serie, window_size, num_bin):
+from transform.window_ops import sliding_windows, paa, to_image_dtype, check_float_dtype, output_array, work_buffer
+
+def MTF(serie, window_size, num_bin, dtype = np.float64):
     """Compute the Markov Transiiton Field of a time series with sliding windows of size window_size if defined, if not defined one image is created. (Binned using quantiles)
     The approach gives the transition probabilities between the states of the pairwise observations as if the trf. would be happening in one step.
     It also shows probabilites of transition to previous states in one step.
@@ -20,6 +22,9 @@ def MTF(serie, window_size, num_bin):
         num_bin : int
             number of quantile bins to create (number of states for markov transition probs)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from MTF_batch)
+
     Returns
     ------------------------
         mtfs : list of numpy matrices of floats
@@ -35,7 +40,7 @@ def MTF(serie, window_size, num_bin):
         print('Image window size should not exceed the length of the data.')
         return()
     elif window_size == len(serie):
-        return MTF_nowindow(serie, num_bin)
+        return MTF_nowindow(serie, num_bin, dtype = dtype)
     elif window_size != None:
         ## Technical arrays, variables
         serie2 = np.array(serie)
@@ -46,7 +51,7 @@ def MTF(serie, window_size, num_bin):
 
         for idx in index_set:
             
-            m, sb, s = MTF_nowindow(serie2[idx:(idx + window_size)], num_bin)
+            m, sb, s = MTF_nowindow(serie2[idx:(idx + window_size)], num_bin, dtype = dtype)
             
             mtfs.append(m)
             series_binned.append(sb)
@@ -55,10 +60,10 @@ def MTF(serie, window_size, num_bin):
     else:
         print(
             'No window size were defined, therefore the MTF is for the whole input series.')
-        return MTF_nowindow(serie, num_bin)
+        return MTF_nowindow(serie, num_bin, dtype = dtype)
 
 
-def MTF_nowindow(series, num_bin):
+def MTF_nowindow(series, num_bin, dtype = np.float64):
     """Compute the Markov Transiiton Field of a time series. (Binned using quantiles)
     The approach gives the transition probabilities between the states of the pairwise observations as if the trf. would be happening in one step.
     It also shows probabilites of transition to previous states in one step.
@@ -71,6 +76,9 @@ def MTF_nowindow(series, num_bin):
         num_bin : int
             number of quantile bins to create (number of states for markov transition probs)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from MTF_batch)
+
     Returns
     ------------------------
         mtf : numpy matrix
@@ -83,17 +91,17 @@ def MTF_nowindow(series, num_bin):
             original input series
         
     """
+    check_float_dtype(dtype)
 
-    mtf = np.eye(len(series))
     X_binned, W = transition_mat(series, num_bin)
 
-    for irow, row in enumerate(X_binned):
-        for icol, col in enumerate(X_binned):
-            mtf[irow, icol] = W[row, col]
+    # W[bin_i, bin_j] for every pair of observations
+    bins = X_binned.reshape(-1)
+    mtf = W.astype(dtype)[bins[:, np.newaxis], bins[np.newaxis, :]]
     return mtf, X_binned, series
 
-def MTF_new_nowindow(series, num_bin):
-    """NOT IN USE NOW. Compute the Markov Transiiton Field of a time series. (Binned using quantiles)
+def MTF_new_nowindow(series, num_bin, dtype = np.float64):
+    """Compute the multi-step Markov Transiiton Field of a time series. (Binned using quantiles)
     The approach only shows transitions to present or future states, so it results ina symmetrical matrix.
     The approach give transition probabilities in multiple time steps if needed.
 
@@ -105,6 +113,9 @@ def MTF_new_nowindow(series, num_bin):
         num_bin : int
             number of quantile bins to create (number of states for markov transition probs)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from MTF_new_batch)
+
     Returns
     ------------------------
         mtf : numpy matrix
@@ -116,17 +127,209 @@ def MTF_new_nowindow(series, num_bin):
         series : np.array
             input series
     """
+    check_float_dtype(dtype)
 
-    mtf = np.eye(len(series))
     X_binned, W = transition_mat(series, num_bin)
-    
-    for irow, row in enumerate(X_binned):
-        for icol, col in enumerate(X_binned[(irow + 1):]):
-            mtf[irow, (irow+icol+1)] = mtf[(irow+icol+1), irow] = np.linalg.matrix_power(W, (icol+1))[row, col]
-    
+
+    # W^(j - i)[bin_i, bin_j] for every pair of observations i <= j, mirrored (W^0 = I on the diagonal)
+    bins = X_binned.reshape(-1)
+    first, second = pair_positions(len(bins))
+    powers = transition_powers(W[np.newaxis], len(bins) - 1)[0]
+    mtf = powers.astype(dtype)[second - first, bins[first], bins[second]]
+
     return mtf, X_binned, series
 
 
+def MTF_new_batch(serie, window_size=None, num_bin=5, chunk_size=2048, dtype=np.float64, out=None, image_size=None):
+    """Compute the multi-step Markov Transiiton Field of every sliding window of a time series in one go. (Binned using quantiles)
+    Gives the same matrices as calling MTF_new_nowindow on each window. The powers W^1..W^(window_size-1) of the
+    transition matrices are computed once per exponent for a chunk of windows, and the fields are gathered from them.
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to turn into MTF matrices
+
+        window_size :  int (default = None)
+            size of windows of time series to use as input for MTF matrices, if not defined one image is created
+
+        num_bin : int (default = 5)
+            number of quantile bins to create (number of states for markov transition probs)
+
+        chunk_size : int (default = 2048)
+            number of windows processed together (bounds the memory used by the matrix powers)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 or uint8 (transition probabilities quantized between 0 and 1)
+
+        out : np.array (default = None)
+            array of shape (n_windows, image_size, image_size) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the binning (images of image_size x image_size instead of window_size x window_size)
+
+    Returns
+    ------------------------
+        mtfs : np.array of shape (n_windows, image_size, image_size)
+            multi-step Markov Transition Field of each window
+            for dtype uint8 a tuple of (quantized matrices, scale, offset), mtfs ~ quantized * scale + offset
+    """
+    if window_size == None:
+        window_size = len(serie)
+    elif len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return()
+
+    windows_binned = quantile_bins(paa(sliding_windows(serie, window_size), image_size), num_bin)
+    image_size = windows_binned.shape[1]
+
+    mtfs = output_array(out, (len(windows_binned), image_size, image_size), dtype)
+    for start in range(0, len(windows_binned), chunk_size):
+        mtf_new_chunk(windows_binned[start:(start + chunk_size)], mtfs[start:(start + chunk_size)], num_bin)
+
+    if np.dtype(dtype) == np.uint8:
+        return mtfs, 1. / 255., 0.
+    return mtfs
+
+
+def MTF_batch(serie, window_size=None, num_bin=5, dtype=np.float64, out=None, chunk_size=4096, image_size=None):
+    """Compute the Markov Transiiton Field of every sliding window of a time series in one go. (Binned using quantiles)
+    Gives the same matrices as calling MTF_nowindow on each window, but the binning, the transition counting and the
+    field fill are array operations over all windows.
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to turn into MTF matrices
+
+        window_size :  int (default = None)
+            size of windows of time series to use as input for MTF matrices, if not defined one image is created
+
+        num_bin : int (default = 5)
+            number of quantile bins to create (number of states for markov transition probs)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 or uint8 (transition probabilities quantized between 0 and 1)
+
+        out : np.array (default = None)
+            array of shape (n_windows, image_size, image_size) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the binning (images of image_size x image_size instead of window_size x window_size)
+
+        chunk_size : int (default = 4096)
+            number of windows processed together
+
+    Returns
+    ------------------------
+        mtfs : np.array of shape (n_windows, image_size, image_size)
+            Markov Transition Field of each window
+            for dtype uint8 a tuple of (quantized matrices, scale, offset), mtfs ~ quantized * scale + offset
+    """
+    if window_size == None:
+        window_size = len(serie)
+    elif len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return()
+
+    windows_binned = quantile_bins(paa(sliding_windows(serie, window_size), image_size), num_bin)
+    image_size = windows_binned.shape[1]
+
+    mtfs = output_array(out, (len(windows_binned), image_size, image_size), dtype)
+    for start in range(0, len(windows_binned), chunk_size):
+        mtf_chunk(windows_binned[start:(start + chunk_size)], mtfs[start:(start + chunk_size)], num_bin)
+
+    if np.dtype(dtype) == np.uint8:
+        return mtfs, 1. / 255., 0.
+    return mtfs
+
+
+def MTF_rolling(serie, window_size, num_bin=5, bin_edges=None, dtype=np.float64, out=None, chunk_size=4096):
+    """Compute the Markov Transiiton Field of every sliding window of a time series with fixed bins (e.g. the
+    quantile_bin_edges of the training period), so that the transition counts can be updated as the window slides.
+    The series is binned once and the transition counts of each window are differences of cumulative counts,
+    so a step costs O(1) regardless of the window size.
+    Without bin_edges the bins are the quantiles of each window, which move with almost every new price; the fields
+    are then computed by MTF_batch.
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to turn into MTF matrices
+
+        window_size :  int
+            size of windows of time series to use as input for MTF matrices
+
+        num_bin : int (default = 5)
+            number of quantile bins to create (number of states for markov transition probs), not used if bin_edges is given
+
+        bin_edges : numpy array of floats (default = None)
+            fixed bin edges for all windows, quantile bins of each window if not defined
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 or uint8 (transition probabilities quantized between 0 and 1)
+
+        out : np.array (default = None)
+            array of shape (n_windows, window_size, window_size) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        chunk_size : int (default = 4096)
+            number of windows processed together
+
+    Returns
+    ------------------------
+        mtfs : np.array of shape (n_windows, window_size, window_size)
+            Markov Transition Field of each window
+            for dtype uint8 a tuple of (quantized matrices, scale, offset), mtfs ~ quantized * scale + offset
+    """
+    serie = np.asarray(serie, dtype=np.float64).reshape(-1)
+    if len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return()
+
+    if bin_edges is None:
+        return MTF_batch(serie, window_size, num_bin, dtype=dtype, out=out, chunk_size=chunk_size)
+
+    mtfs = output_array(out, (len(serie) - window_size + 1, window_size, window_size), dtype)
+    _MTF_fixed_bins(serie, window_size, np.asarray(bin_edges, dtype=np.float64), mtfs, chunk_size)
+
+    if np.dtype(dtype) == np.uint8:
+        return mtfs, 1. / 255., 0.
+    return mtfs
+
+
+def _MTF_fixed_bins(serie, window_size, bin_edges, target, chunk_size):
+    """Write the MTF of every sliding window with the same bin edges for all windows into target
+    (transition counts from cumulative sums, fields gathered chunk by chunk)."""
+    n_states = len(bin_edges) - 1
+    n_windows = len(serie) - window_size + 1
+    binned = digitize_rows(serie[np.newaxis], bin_edges[np.newaxis], np.ones((1, n_states), dtype=bool))[0].astype(np.intp)
+
+    # cumulative[k] counts the transitions (from, to) among the first k transitions of the series
+    cumulative = np.zeros((len(serie), n_states * n_states), dtype=np.int64)
+    cumulative[np.arange(1, len(serie)), binned[:-1] * n_states + binned[1:]] = 1
+    np.cumsum(cumulative, axis=0, out=cumulative)
+
+    windows_binned = sliding_windows(binned, window_size)
+    for start in range(0, n_windows, chunk_size):
+        end = min(start + chunk_size, n_windows)
+
+        # window idx holds the transitions idx .. idx + window_size - 2
+        counts = cumulative[(start + window_size - 1):(end + window_size - 1)] - cumulative[start:end]
+        W = counts.reshape(end - start, n_states, n_states).astype(np.float64)
+
+        #make probs
+        rowsum = W.sum(axis=-1, keepdims=True)
+        np.divide(W, rowsum, out=W, where=rowsum != 0)
+
+        gather_fields(_probs_to_dtype(W, target.dtype), windows_binned[start:end].astype(np.intp), target[start:end])
+
+
+
 def transition_mat(series, num_bin):
     """Compute the Markov Transiiton Matrix of a time series. Binned using quantiles.
 
@@ -146,24 +349,241 @@ def transition_mat(series, num_bin):
         W : numpy matrix
             Markov Transition Matrix of input series
     """
-    series = np.array(series).reshape(-1, 1)
-    est = KBinsDiscretizer(
-        n_bins=num_bin, encode="ordinal", strategy="quantile")
-    est.fit(series)
-    X_binned = np.array(est.transform(series), dtype=np.int16)
-    n = np.int(1 + max(X_binned))  # states labelled as ints from 0
+    series = np.array(series, dtype=np.float64).reshape(1, -1)
+    X_binned = quantile_bins(series, num_bin).reshape(-1, 1)
+    n = int(1 + X_binned.max())  # states labelled as ints from 0
+
+    W = transition_probs(X_binned.reshape(1, -1), n)[0]
+
+    return X_binned, W
+
+
+def quantile_bins(windows, num_bin, sorted_windows=None, out=None):
+    """Bin each row of a 2D array by its own quantiles.
+    Same as fitting KBinsDiscretizer(n_bins=num_bin, encode="ordinal", strategy="quantile") on every row separately
+    (linear percentiles, bins narrower than 1e-8 removed, values within numerical tolerance of an edge put in the upper bin),
+    without fitting an estimator per row.
+
+    Parameters
+    ------------------------
+        windows : 2D numpy array
+            one series (window) per row
+
+        num_bin : int
+            number of quantile bins to create
+
+        sorted_windows : 2D numpy array (default = None)
+            the rows of windows sorted, if already available (the edges are then read from it instead of np.percentile)
+
+        out : numpy array of int16 (default = None)
+            array of the shape of windows to write the bins into
+
+    Returns
+    ------------------------
+        binned : numpy array of ints (same shape as windows)
+            bin index of every value within its own row
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+
+    # quantile bin edges per row
+    if sorted_windows is None:
+        edges = np.percentile(windows, np.linspace(0, 100, num_bin + 1), axis=-1).T
+    else:
+        lower, upper, gamma = percentile_positions(windows.shape[-1], num_bin)
+        edges = _lerp(sorted_windows[:, lower], sorted_windows[:, upper], gamma)
+
+    # Remove bins whose width are too small (i.e., <= 1e-8), keep[:, i] refers to the right edge of bin i
+    keep = np.diff(edges, axis=-1) > 1e-8
+    return digitize_rows(windows, edges, keep, out=out)
+
+
+def digitize_rows(windows, edges, keep, out=None):
+    """Bin each row of a 2D array with its own bin edges (np.digitize with numerical tolerance, as KBinsDiscretizer).
+
+    Parameters
+    ------------------------
+        windows : 2D numpy array
+            one series (window) per row
+
+        edges : 2D numpy array
+            bin edges of each row (n_rows, n_edges)
+
+        keep : 2D numpy array of bools
+            which right edges (edges[:, 1:]) are used, bins ending at a dropped edge are merged into the next bin
+
+        out : numpy array of int16 (default = None)
+            array of the shape of windows to write the bins into
+
+    Returns
+    ------------------------
+        binned : numpy array of ints (same shape as windows)
+            bin index of every value within its own row
+    """
+    n_bins = keep.sum(axis=-1)
+
+    # Values close to a bin edge are susceptible to numeric instability (see numpy.isclose)
+    shifted = windows + (1.e-8 + 1.e-5 * np.abs(windows))
+
+    # number of kept right edges below each value (np.digitize), clipped to the valid bins
+    if out is None:
+        out = np.empty(windows.shape, dtype=np.int16)
+    np.sum((edges[:, np.newaxis, 1:] <= shifted[:, :, np.newaxis]) & keep[:, np.newaxis, :], axis=-1, out=out)
+    np.minimum(out, np.maximum(n_bins - 1, 0)[:, np.newaxis], out=out)
+    return out
+
 
-    W = np.zeros((n, n))
+def quantile_bin_edges(serie, num_bin):
+    """Quantile bin edges of a series, e.g. of a training period, to bin other data with fixed edges (see MTF_rolling).
+    Same edges as KBinsDiscretizer(n_bins=num_bin, encode="ordinal", strategy="quantile") fitted on the series.
 
-    for (i, j) in zip(X_binned, X_binned[1:]):
-        W[i, j] += 1
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            series to compute the bin edges from
+
+        num_bin : int
+            number of quantile bins to create
+
+    Returns
+    ------------------------
+        bin_edges : numpy array of floats
+            edges of the bins (bins narrower than 1e-8 removed, [-inf, inf] for a constant series)
+    """
+    serie = np.asarray(serie, dtype=np.float64).reshape(-1)
+    edges = np.percentile(serie, np.linspace(0, 100, num_bin + 1))
+    keep = np.diff(edges) > 1e-8
+    if not keep.any():
+        return np.array([-np.inf, np.inf])
+    return np.concatenate((edges[:1], edges[1:][keep]))
+
+
+def transition_probs(binned, n_states):
+    """Markov Transition Matrices of binned series, one per row.
+
+    Parameters
+    ------------------------
+        binned : 2D numpy array of ints
+            binned series (states labelled as ints from 0), one per row
+
+        n_states : int
+            number of states (size of the transition matrices)
+
+    Returns
+    ------------------------
+        W : numpy array of shape (n_rows, n_states, n_states)
+            Markov Transition Matrix of each row
+    """
+    W = transition_counts(binned, n_states)
 
     #make probs
-    for idx, rowsum in enumerate(W.sum(axis=1)):
-        if rowsum != 0:
-            W[idx, :] = W[idx, :]/rowsum
+    rowsum = W.sum(axis=-1, keepdims=True)
+    np.divide(W, rowsum, out=W, where=rowsum != 0)
+    return W
 
-    return X_binned, W
+
+def transition_counts(binned, n_states):
+    """Number of transitions between the states of binned series, one matrix per row (as floats)."""
+    n_rows = len(binned)
+    binned = binned.astype(np.intp)
+
+    # count transitions: each (row, from, to) triplet gets one flat index
+    flat_idx = (np.arange(n_rows)[:, np.newaxis] * n_states + binned[:, :-1]) * n_states + binned[:, 1:]
+    counts = np.bincount(flat_idx.reshape(-1), minlength=n_rows * n_states * n_states)
+    return counts.reshape(n_rows, n_states, n_states).astype(np.float64)
+
+
+def transition_powers(W, max_power):
+    """Powers W^0..W^max_power of a stack of transition matrices (W^0 is the identity).
+
+    Parameters
+    ------------------------
+        W : numpy array of shape (n_rows, n_states, n_states)
+            Markov Transition Matrices
+
+        max_power : int
+            highest power to compute
+
+    Returns
+    ------------------------
+        powers : numpy array of shape (n_rows, max_power + 1, n_states, n_states)
+            powers[:, k] is W^k
+    """
+    powers = np.empty((W.shape[0], max_power + 1) + W.shape[1:])
+    powers[:, 0] = np.eye(W.shape[-1])
+    for k in range(1, max_power + 1):
+        powers[:, k] = np.linalg.matrix_power(W, k)
+    return powers
+
+
+def mtf_chunk(binned, target, num_bin, work=None, rows=None):
+    """Write the Markov Transition Fields of a chunk of binned windows into target (its dtype is the output dtype).
+    target[window, i, j] = W[window, bin_i, bin_j]
+    work (shape of target) and rows (n_windows, window_size, num_bin) are optional preallocated arrays of the output
+    dtype, with rows the fields are gathered window by window without temporary arrays of their size."""
+    W = _probs_to_dtype(transition_probs(binned, num_bin), target.dtype)
+    gather_fields(W, binned, target, work=work, rows=rows)
+
+
+def gather_fields(W, binned, target, work=None, rows=None):
+    """Write W[window, bin_i, bin_j] for every pair of observations of a chunk of binned windows into target.
+    W holds the transition probabilities of each window in the dtype of target, work and rows as in mtf_chunk."""
+    if rows is None:
+        # W[window, bin_i, bin_j] for every pair of observations in every window
+        window_idx = np.arange(len(binned))[:, np.newaxis, np.newaxis]
+        target[...] = W[window_idx, binned[:, :, np.newaxis], binned[:, np.newaxis, :]]
+        return
+
+    # row bin_i of W for every observation, then column bin_j of those rows (np.take only writes into contiguous
+    # arrays without buffering, hence work for one channel of a channels-last target)
+    images = work_buffer(target, target.dtype, work)
+    for window in range(len(binned)):
+        np.take(W[window], binned[window], axis=0, out=rows[window], mode='clip')
+        np.take(rows[window], binned[window], axis=1, out=images[window], mode='clip')
+    if images is not target:
+        np.copyto(target, images)
+
+
+def mtf_new_chunk(binned, target, num_bin):
+    """Write the multi-step Markov Transition Fields of a chunk of binned windows into target (its dtype is the output dtype).
+    target[window, i, j] = W^|j - i|[window, bin_min(i,j), bin_max(i,j)]"""
+    window_size = binned.shape[1]
+    first, second = pair_positions(window_size)
+
+    powers = transition_powers(transition_probs(binned, num_bin), window_size - 1)
+    powers = _probs_to_dtype(powers, target.dtype)
+
+    # powers[window, j - i, bin_i, bin_j] for every pair of observations i <= j in every window, mirrored
+    window_idx = np.arange(len(binned))[:, np.newaxis, np.newaxis]
+    target[...] = powers[window_idx, second - first, binned[:, first], binned[:, second]]
+
+
+@lru_cache(maxsize=64)
+def percentile_positions(n, num_bin):
+    """Positions (lower, upper) and weights of the linear quantile bin edges in a sorted array of length n (as np.percentile).
+    Cached, as they only depend on n and num_bin (the returned arrays must not be modified)."""
+    virtual = (n - 1) * (np.linspace(0, 100, num_bin + 1) / 100)
+    lower = np.minimum(np.floor(virtual).astype(np.intp), n - 1)
+    upper = np.minimum(lower + 1, n - 1)
+    gamma = virtual - np.floor(virtual)
+    return lower, upper, gamma
+
+
+def pair_positions(n):
+    """Matrices of min(i, j) and max(i, j) for i, j in range(n) (earlier and later observation of each pair)."""
+    idx = np.arange(n)
+    return np.minimum.outer(idx, idx), np.maximum.outer(idx, idx)
+
+
+def _probs_to_dtype(W, dtype):
+    """Transition probabilities in the output dtype (uint8 quantized between 0 and 1), so that the fields are gathered directly in that type."""
+    W = to_image_dtype(W, dtype, (0, 1))
+    return W[0] if isinstance(W, tuple) else W
+
+
+def _lerp(a, b, t):
+    """Linear interpolation between a and b, with the same rounding as np.percentile."""
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import numpy as np
+
+from transform.window_ops import sliding_windows, paa, work_dtype, check_image_dtype, output_array, uint8_scale
+from transform.gramian_angular_field import polar_encoding, gaf_chunk
+from transform.recurrence_plot import distance_band, band_window_positions, rp_chunk, rp_windows_chunk, max_window_distance
+from transform.markov_transition_field import quantile_bins, mtf_chunk, mtf_new_chunk
+
+
+# All requested transformations of every sliding window in one pass
+def multi_transform_batch(serie, window_size, trf_list,
+                          num_bin=5,
+                          padding_RP=0,
+                          standardize_out_RP=False,
+                          standardize_out_GASF=False,
+                          standardize_out_GADF=False,
+                          dtype=np.float64,
+                          out=None,
+                          chunk_size=512,
+                          image_size=None):
+    """Compute several image transformations of every sliding window of a time series, sharing the work between them.
+    The windows are sliced (and PAA reduced) once; the angles are computed once for GASF and GADF; when an MTF is requested the windows
+    are sorted once, giving both the quantile bin edges and the minimum / maximum used for the GAF scaling; the RP
+    distances are computed once for the whole series. The images are then written chunk by chunk into one
+    channels-last array. Gives the same images as the separate batch functions (GASF_batch, GADF_batch, RP_batch,
+    MTF_batch, MTF_new_batch).
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            time series to transform
+
+        window_size : int
+            size of windows of time series to use as input for the images
+
+        trf_list : list of strings ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new')
+            transformations to compute, one channel each in this order
+
+        num_bin : int (default = 5)
+            number of quantile bins of the MTF and MTF_new images
+
+        padding_RP : int (default = 0)
+            number of rows/columns of zero padding to be added to the right and bottom of the RP images
+
+        standardize_out_RP, standardize_out_GASF, standardize_out_GADF : bool (default = False)
+            whether the resulting RP / GASF / GADF images should be standardized between 0 and 1 (minmax scaler)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 (computed in float32) or uint8
+
+        out : np.array (default = None)
+            array of shape (n_windows, size, size, len(trf_list)) and type dtype to write the images into
+
+        chunk_size : int (default = 512)
+            number of windows processed together
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the transformations (see the image_size of the batch functions)
+
+    Returns
+    ------------------------
+        images : np.array of shape (n_windows, size, size, len(trf_list))
+            images of each window, channels last
+
+        quantization : dict (only returned if dtype is uint8)
+            (scale, offset) of each transformation, image values ~ uint8 values * scale + offset
+    """
+    check_image_dtype(dtype)
+    serie = np.asarray(serie, dtype=np.float64).reshape(-1)
+    if len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return()
+
+    for trf in trf_list:
+        if trf not in ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new'):
+            raise Exception('Unknown image transformation ' + str(trf) + ', please choose from GASF, GADF, RP, MTF or MTF_new.')
+
+    reduced_size = window_size if image_size == None else image_size
+    sizes = [reduced_size - 1 + padding_RP if trf == 'RP' else reduced_size for trf in trf_list]
+    if len(set(sizes)) > 1:
+        raise Exception('All transformations should give images of the same size, got ' + str(dict(zip(trf_list, sizes)))
+                        + ' (set padding_RP = 1 to combine RP with the other transformations).')
+
+    windows = paa(sliding_windows(serie, window_size), image_size)
+    n_windows = len(windows)
+    images = output_array(out, (n_windows, sizes[0], sizes[0], len(trf_list)), dtype)
+
+    # shared intermediates, each computed once for all the channels that need it
+    use_mtf = ('MTF' in trf_list) or ('MTF_new' in trf_list)
+    use_gaf = ('GASF' in trf_list) or ('GADF' in trf_list)
+
+    if use_mtf:
+        sorted_windows = np.sort(windows, axis=-1)
+        windows_binned = quantile_bins(windows, num_bin, sorted_windows=sorted_windows)
+
+    if use_gaf:
+        if use_mtf:
+            phi = polar_encoding(windows, dtype, data_min=sorted_windows[:, :1], data_max=sorted_windows[:, -1:])
+        else:
+            phi = polar_encoding(windows, dtype)
+
+    # the RP distances of PAA reduced windows are computed per window (the reduced windows share no points)
+    use_band = reduced_size == window_size
+    if ('RP' in trf_list) and use_band:
+        band = distance_band(serie.astype(work_dtype(dtype)), window_size - 1)
+        band_windows, positions = band_window_positions(band, n_windows)
+        rp_range = (0, 1) if standardize_out_RP == True else (0, band.max())
+    elif 'RP' in trf_list:
+        rp_windows = windows.astype(work_dtype(dtype))
+        if standardize_out_RP == True:
+            rp_range = (0, 1)
+        elif np.dtype(dtype) == np.uint8:
+            rp_range = (0, max_window_distance(rp_windows, chunk_size))
+        else:
+            rp_range = None
+
+    value_ranges = {'GASF': (0, 1) if standardize_out_GASF == True else (-1, 1),
+                    'GADF': (0, 1) if standardize_out_GADF == True else (-1, 1),
+                    'RP': rp_range if 'RP' in trf_list else None,
+                    'MTF': (0, 1),
+                    'MTF_new': (0, 1)}
+
+    for start in range(0, n_windows, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        for c, trf in enumerate(trf_list):
+            target = images[chunk, ..., c]
+            if trf == 'GASF':
+                gaf_chunk(phi[chunk], target, 'summation', standardize_out=standardize_out_GASF)
+            elif trf == 'GADF':
+                gaf_chunk(phi[chunk], target, 'difference', standardize_out=standardize_out_GADF)
+            elif (trf == 'RP') and use_band:
+                rp_chunk(band_windows[chunk], positions, target, standardize_out=standardize_out_RP, value_range=rp_range)
+            elif trf == 'RP':
+                rp_windows_chunk(rp_windows[chunk], target, standardize_out=standardize_out_RP, value_range=rp_range)
+            elif trf == 'MTF':
+                mtf_chunk(windows_binned[chunk], target, num_bin)
+            else:
+                mtf_new_chunk(windows_binned[chunk], target, num_bin)
+
+    if np.dtype(dtype) == np.uint8:
+        return(images, {trf: uint8_scale(value_ranges[trf]) for trf in trf_list})
+    return(images)
@@ -4,9 +4,12 @@ from sklearn.preprocessing import MinMaxScaler
 import matplotlib.pyplot as plt
 from scipy.spatial.distance import pdist
 from scipy.spatial.distance import squareform
+from numpy.lib.stride_tricks import as_strided
+
+from transform.window_ops import sliding_windows, paa, minmax_scale, work_dtype, to_image_dtype, check_float_dtype, uint8_scale, output_array, work_buffer
 
 # Recurrence Plot for various windows in time series
-def RP(serie, window_size = None, padding = 0, standardize_out = False):
+def RP(serie, window_size = None, padding = 0, standardize_out = False, dtype = np.float64):
     """ Compute the Recurrence Plot of a time series (for each sliding window defined by window_size).
    
     Parameters
@@ -21,7 +24,10 @@ def RP(serie, window_size = None, padding = 0, standardize_out = False):
 
         standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
-    
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from RP_batch)
+
     Returns
     --------------------------
         recurrence_plots :  list of matrices
@@ -34,7 +40,7 @@ def RP(serie, window_size = None, padding = 0, standardize_out = False):
             print('Image window size should not exceed the length of the data.')
             return()
         elif window_size == len(serie):
-            return recurrence_plot_nowindow(serie, padding=padding, standardize_out=standardize_out)
+            return recurrence_plot_nowindow(serie, padding=padding, standardize_out=standardize_out, dtype=dtype)
         else:
     
             ## Technical arrays, variables
@@ -45,7 +51,7 @@ def RP(serie, window_size = None, padding = 0, standardize_out = False):
 
             for idx in index_set:
                 rp, os = recurrence_plot_nowindow(
-                    serie2[idx:(idx + window_size)], padding=padding, standardize_out=standardize_out)
+                    serie2[idx:(idx + window_size)], padding=padding, standardize_out=standardize_out, dtype=dtype)
 
                 recurrence_plots.append(rp)
 
@@ -53,10 +59,10 @@ def RP(serie, window_size = None, padding = 0, standardize_out = False):
     else:
         print(
             'No window size were defined, therefore the GASF is for the whole input series.')
-        return recurrence_plot_nowindow(serie, padding = padding , standardize_out=standardize_out)
+        return recurrence_plot_nowindow(serie, padding = padding , standardize_out=standardize_out, dtype = dtype)
 
 # Recurrence Plot transformation funtion
-def recurrence_plot_nowindow(serie, padding = 0, standardize_out = False):
+def recurrence_plot_nowindow(serie, padding = 0, standardize_out = False, dtype = np.float64):
     """Compute the Recurrence Plot of a time series (for the full input).
     
     Parameters
@@ -69,6 +75,9 @@ def recurrence_plot_nowindow(serie, padding = 0, standardize_out = False):
         standardize_out : bool (default = False)
             whether the resulting image should be standardized between 0 and 1 (minmax scaler)
 
+        dtype : numpy dtype (default = np.float64)
+            type of the output matrices: float64, float32 or float16 (uint8 is available from RP_batch)
+
     Returns
     ---------------------
         distances : recurrence plot
@@ -76,6 +85,8 @@ def recurrence_plot_nowindow(serie, padding = 0, standardize_out = False):
         serie : original input series
 
     """
+    check_float_dtype(dtype)
+
     # 2D phase space trajectories (s)
     new_serie = np.transpose(np.array((serie[:-1], serie[1:])))
     
@@ -95,7 +106,226 @@ def recurrence_plot_nowindow(serie, padding = 0, standardize_out = False):
         distances2 = np.zeros((distances.shape[0]+padding,distances.shape[0]+padding))
         distances2[:-1,:-1] = distances
 
-    return(distances2, serie)
+    return(distances2.astype(dtype, copy=False), serie)
+
+
+# Recurrence Plot for all sliding windows at once
+def RP_batch(serie, window_size = None, padding = 0, standardize_out = False, dtype = np.float64, out = None, chunk_size = 4096, image_size = None):
+    """ Compute the Recurrence Plot of every sliding window of a time series in one go.
+    The distances between the 2D phase space trajectory points of the full series are computed once, for the band |i - j| < window_size - 1
+    (all pairs that share a window), and the plot of each window is gathered from that band.
+    Gives the same matrices as calling recurrence_plot_nowindow on each window.
+    With image_size the windows are PAA reduced first; the reduced windows share no points, so their distances are computed per window.
+
+    Parameters
+    -------------------------
+        serie : np.array or list
+
+        window_size:  (default = None) int
+            size of windows of time series to use as input for the recurrence plots, if not defined one image is created
+
+        padding : int (default = 0)
+            number of rows/columns of zero padding to be added to the right and bottom
+
+        standardize_out : bool (default = False)
+            whether the resulting images should be standardized between 0 and 1 (minmax scaler)
+
+        dtype : numpy dtype (default = np.float64)
+            type of the output: float64, float32, float16 (computed in float32) or uint8
+            (quantized between 0 and 1 if standardize_out, otherwise between 0 and the largest distance)
+
+        out : np.array (default = None)
+            array of shape (n_windows, image_size - 1 + padding, image_size - 1 + padding) and type dtype to write the images into
+            (e.g. one channel of a preallocated channels-last array)
+
+        chunk_size : int (default = 4096)
+            number of windows gathered together (bounds the working memory when dtype is float16 or uint8)
+
+        image_size : int (default = None)
+            if defined, each window is reduced to image_size values by Piecewise Aggregate Approximation before
+            the transformation (image_size - 1 trajectory points instead of window_size - 1)
+
+    Returns
+    --------------------------
+        recurrence_plots : np.array of shape (n_windows, image_size - 1 + padding, image_size - 1 + padding)
+            recurrence plot for each window
+            for dtype uint8 a tuple of (quantized plots, scale, offset), recurrence_plots ~ quantized * scale + offset
+    """
+    serie = np.asarray(serie, dtype=np.float64).reshape(-1)
+    if window_size == None:
+        window_size = len(serie)
+    elif len(serie) < window_size:
+        print('Image window size should not exceed the length of the data.')
+        return()
+
+    if (image_size != None) and (image_size != window_size):
+        return(_RP_paa_batch(serie, window_size, image_size, padding, standardize_out, dtype, out, chunk_size))
+
+    # number of trajectory points in a window, number of windows
+    n = window_size - 1
+    n_windows = len(serie) - window_size + 1
+
+    # band[k, lag] = distance between trajectory points k and k + lag
+    band = distance_band(serie.astype(work_dtype(dtype)), n)
+
+    band_windows, positions = band_window_positions(band, n_windows)
+
+    value_range = (0, 1) if standardize_out == True else (0, band.max())
+    recurrence_plots = output_array(out, (n_windows, n + padding, n + padding), dtype)
+
+    for start in range(0, n_windows, chunk_size):
+        rp_chunk(band_windows[start:(start + chunk_size)], positions, recurrence_plots[start:(start + chunk_size)],
+                 standardize_out=standardize_out, value_range=value_range)
+
+    if np.dtype(dtype) == np.uint8:
+        return((recurrence_plots,) + uint8_scale(value_range))
+    return(recurrence_plots)
+
+
+def _RP_paa_batch(serie, window_size, image_size, padding, standardize_out, dtype, out, chunk_size):
+    """RP_batch of the PAA reduced windows (distances computed per window, see window_distances)."""
+    windows = paa(sliding_windows(serie, window_size), image_size).astype(work_dtype(dtype))
+    n = image_size - 1
+
+    if standardize_out == True:
+        value_range = (0, 1)
+    elif np.dtype(dtype) == np.uint8:
+        # largest distance of all windows, to quantize all plots alike
+        value_range = (0, max_window_distance(windows, chunk_size))
+    else:
+        value_range = None
+    recurrence_plots = output_array(out, (len(windows), n + padding, n + padding), dtype)
+
+    for start in range(0, len(windows), chunk_size):
+        rp_windows_chunk(windows[start:(start + chunk_size)], recurrence_plots[start:(start + chunk_size)],
+                         standardize_out=standardize_out, value_range=value_range)
+
+    if np.dtype(dtype) == np.uint8:
+        return((recurrence_plots,) + uint8_scale(value_range))
+    return(recurrence_plots)
+
+
+def window_distances(windows, out=None, diff=None):
+    """Euclidean distances between the 2D phase space trajectory points of each window (row).
+
+    Parameters
+    ---------------------
+        windows : np.array of shape (n_windows, m)
+            one window per row
+
+        out : np.array (default = None)
+            array of shape (n_windows, m - 1, m - 1) to write the distances into
+
+        diff : np.array (default = None)
+            array of the same shape to use as working memory
+
+    Returns
+    ---------------------
+        distances : np.array of shape (n_windows, m - 1, m - 1)
+            distance matrix of each window
+    """
+    # 2D phase space trajectories (s): points (x_k, x_k+1)
+    first, second = windows[:, :-1], windows[:, 1:]
+
+    distances = np.subtract(first[:, :, np.newaxis], first[:, np.newaxis, :], out=out)
+    np.square(distances, out=distances)
+    diff = np.subtract(second[:, :, np.newaxis], second[:, np.newaxis, :], out=diff)
+    np.square(diff, out=diff)
+    distances += diff
+    return(np.sqrt(distances, out=distances))
+
+
+def max_window_distance(windows, chunk_size=4096):
+    """Largest distance between the trajectory points of any window (see window_distances), computed chunk by chunk."""
+    return(max(window_distances(windows[start:(start + chunk_size)]).max() for start in range(0, len(windows), chunk_size)))
+
+
+def distance_band(serie, n):
+    """Euclidean distances between the 2D phase space trajectory points of a series, only for pairs closer than n steps.
+
+    Parameters
+    ---------------------
+        serie : np.array
+            input series
+
+        n : int
+            width of the band
+
+    Returns
+    ---------------------
+        band : np.array of shape (len(serie) - 1, n)
+            band[k, lag] is the distance between the trajectory points k and k + lag (0 where k + lag is out of range)
+    """
+    # 2D phase space trajectories (s)
+    trajectory = np.transpose(np.array((serie[:-1], serie[1:])))
+    n_points = len(trajectory)
+
+    band = np.zeros((n_points, n), dtype=trajectory.dtype)
+    for lag in range(1, min(n, n_points)):
+        diff = trajectory[:-lag] - trajectory[lag:]
+        np.square(diff, out=diff)
+        band[:-lag, lag] = np.sqrt(diff[:, 0] + diff[:, 1])
+
+    return(band)
+
+
+def band_window_positions(band, n_windows):
+    """Flattened band starting at each window (read-only view) and the positions of the plot values in it.
+    The plot of window idx is band[idx + min(i, j), |i - j|], i.e. a fixed pattern of positions
+    in the n * n values of the flattened band starting at band[idx, 0]."""
+    n = band.shape[1]
+    rows = np.arange(n)
+    positions = (np.minimum.outer(rows, rows) * n + np.abs(np.subtract.outer(rows, rows))).reshape(-1)
+    band_windows = as_strided(band, shape=(n_windows, n * n), strides=(band.strides[0], band.strides[1]), writeable=False)
+    return(band_windows, positions)
+
+
+def rp_chunk(band_windows, positions, target, standardize_out=False, value_range=(0, 1)):
+    """Write the recurrence plots of a chunk of windows into target (zero padded to its size).
+
+    Parameters
+    ---------------------
+        band_windows, positions : np.array
+            see band_window_positions (only the rows of the chunk)
+
+        target : np.array of shape (n_windows, n + padding, n + padding)
+            array to write the plots into, its dtype is the output dtype
+
+        standardize_out : bool (default = False)
+            whether the resulting images should be standardized between 0 and 1 (minmax scaler)
+
+        value_range : tuple (default = (0, 1))
+            range of the plot values, used to quantize uint8 output
+    """
+    n = math.isqrt(len(positions))
+    images = work_buffer(target, band_windows.dtype)
+    images[:, :n, :n] = np.take(band_windows, positions, axis=1).reshape(-1, n, n)
+    _finish_rp(images, n, target, standardize_out, value_range)
+
+
+def rp_windows_chunk(windows, target, standardize_out=False, value_range=(0, 1), work=None, diff=None):
+    """Write the recurrence plots of a chunk of (PAA reduced) windows into target (zero padded to its size).
+    Same as rp_chunk, with the distances computed per window from the windows (n_windows, m).
+    work (shape of target) and diff (n_windows, m - 1, m - 1) are optional preallocated arrays of the type of windows."""
+    n = windows.shape[1] - 1
+    images = work_buffer(target, windows.dtype, work)
+    window_distances(windows, out=images[:, :n, :n], diff=diff)
+    _finish_rp(images, n, target, standardize_out, value_range)
+
+
+def _finish_rp(images, n, target, standardize_out, value_range):
+    """Zero padding, optional standardization of the distances images[:, :n, :n] and conversion into target."""
+    # zero padding to the right and bottom
+    images[:, n:, :] = 0
+    images[:, :n, n:] = 0
+
+    distances = images[:, :n, :n]
+    if standardize_out == True:
+        # column-wise, as MinMaxScaler fitted on each matrix
+        minmax_scale(distances, feature_range=(0, 1), axis=-2, out=distances)
+
+    to_image_dtype(images, target.dtype, value_range, out=target)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+import time
+import numpy as np
+
+from transform.window_ops import paa, minmax_scale, work_dtype, check_image_dtype, uint8_scale
+from transform.gramian_angular_field import gaf_chunk
+from transform.recurrence_plot import rp_windows_chunk
+from transform.markov_transition_field import quantile_bins, mtf_chunk, mtf_new_chunk
+
+
+class StreamingImageTransformer:
+    """Image of the latest window of a live price series, updated bar by bar.
+    The last image_window_size prices (or returns) are kept in a ring buffer, and every push of a new price writes
+    the multi-channel image of the latest window into the same output buffer, using preallocated working arrays.
+    The images are the same as the ones of the batch path (multi_transform_batch / data_to_labelled_img) for the
+    same window (also for a zero price with use_returns, whose return is inf as with the batch returns). The MTF
+    channel is binned and gathered into preallocated arrays, only the bin edges and transition matrices (of the size
+    of the window or num_bin x num_bin) are allocated per push; the matrix powers of MTF_new are not preallocated.
+    The time taken by each push is measured (last_latency, mean_latency, max_latency).
+
+    Parameters
+    -------
+        image_window_size : int
+            the window size for image creation
+
+        image_trf_strat : string or list of strings ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new')
+            the image transformation strategy (a string gives images without channel axis)
+
+        num_bin, padding_RP, standardize_out_RP, standardize_out_GASF, standardize_out_GADF, use_returns, image_size :
+            same as in data_to_labelled_img
+
+        dtype : numpy dtype (default = np.float64)
+            type of the images: float64, float32, float16 or uint8 (not for RP images unless standardize_out_RP,
+            their quantization range depends on the whole series); see quantization
+
+        latency_target : float (default = None)
+            time in seconds a push should take at most, the pushes over it are counted in n_over_target
+
+    Attributes
+    -------
+        image : np.array
+            output buffer, the image of the latest window (overwritten by the next push)
+
+        quantization : dict
+            (scale, offset) of each transformation for uint8 images
+    """
+    def __init__(self, image_window_size, image_trf_strat,
+                 num_bin=5,
+                 padding_RP=0,
+                 standardize_out_RP=False,
+                 standardize_out_GASF=False,
+                 standardize_out_GADF=False,
+                 use_returns=False,
+                 dtype=np.float64,
+                 image_size=None,
+                 latency_target=None):
+        check_image_dtype(dtype)
+        self.trf_list = [image_trf_strat] if isinstance(image_trf_strat, str) else list(image_trf_strat)
+        for trf in self.trf_list:
+            if trf not in ('GASF', 'GADF', 'RP', 'MTF', 'MTF_new'):
+                raise Exception('Unknown image transformation ' + str(trf) + ', please choose from GASF, GADF, RP, MTF or MTF_new.')
+        if (np.dtype(dtype) == np.uint8) and ('RP' in self.trf_list) and (standardize_out_RP != True):
+            raise Exception('uint8 RP images need standardize_out_RP = True when streaming.')
+
+        self.window_size = image_window_size
+        self.image_size = image_window_size if image_size == None else image_size
+        sizes = [self.image_size - 1 + padding_RP if trf == 'RP' else self.image_size for trf in self.trf_list]
+        if len(set(sizes)) > 1:
+            raise Exception('All transformations should give images of the same size, got ' + str(dict(zip(self.trf_list, sizes)))
+                            + ' (set padding_RP = 1 to combine RP with the other transformations).')
+
+        self.num_bin = num_bin
+        self.standardize_out = {'GASF': standardize_out_GASF, 'GADF': standardize_out_GADF, 'RP': standardize_out_RP}
+        self.use_returns = use_returns
+        self.latency_target = latency_target
+
+        # output buffer and a (1, size, size) view of each channel
+        size = sizes[0]
+        if isinstance(image_trf_strat, str):
+            self.image = np.empty((size, size), dtype=dtype)
+            self.channels = [self.image[np.newaxis]]
+        else:
+            self.image = np.empty((size, size, len(self.trf_list)), dtype=dtype)
+            self.channels = [self.image[np.newaxis, ..., c] for c in range(len(self.trf_list))]
+
+        value_ranges = {'GASF': (0, 1) if standardize_out_GASF == True else (-1, 1),
+                        'GADF': (0, 1) if standardize_out_GADF == True else (-1, 1),
+                        'RP': (0, 1), 'MTF': (0, 1), 'MTF_new': (0, 1)}
+        self.quantization = {trf: uint8_scale(value_ranges[trf]) for trf in self.trf_list}
+
+        # ring buffer written twice (at i and i + window_size), so the window is always one contiguous slice
+        self.values = np.zeros(2 * image_window_size)
+        self.position = 0
+        self.count = 0
+        self.last_price = None
+
+        # working arrays
+        work = work_dtype(dtype)
+        m = self.image_size
+        self.reduced = np.empty((1, m)) if m != image_window_size else None
+        # angles are computed in float64 (as polar_encoding) and then cast to the work dtype
+        self.angles = np.empty((1, m))
+        self.phi = self.angles if work == np.float64 else np.empty((1, m), dtype=work)
+        self.gaf_work = np.empty((1, m, m), dtype=work)
+        self.rp_window = np.empty((1, m), dtype=work)
+        self.rp_work = np.empty((1, size, size), dtype=work)
+        self.rp_diff = np.empty((1, m - 1, m - 1), dtype=work)
+        self.sorted_window = np.empty((1, m))
+        self.binned = np.empty((1, m), dtype=np.int16)
+        self.mtf_rows = np.empty((1, m, num_bin), dtype=dtype)
+        self.mtf_work = np.empty((1, m, m), dtype=dtype) if not isinstance(image_trf_strat, str) else None
+
+        self.last_latency = None
+        self.max_latency = 0.
+        self.total_latency = 0.
+        self.n_images = 0
+        self.n_over_target = 0
+
+    def push(self, price):
+        """Add the price of a new bar.
+
+        Returns
+        -------
+            image : np.array or None
+                image of the latest window (the output buffer, overwritten by the next push),
+                None until image_window_size values (prices, or returns) are available
+        """
+        start = time.perf_counter()
+
+        if self.use_returns:
+            previous, self.last_price = self.last_price, price
+            if previous is None:
+                return None
+            # numpy division as in the batch path: a zero previous price gives inf (nan for 0/0) and a warning
+            value = np.float64(price)/previous - 1
+        else:
+            value = price
+
+        self.values[self.position] = value
+        self.values[self.position + self.window_size] = value
+        self.position = (self.position + 1) % self.window_size
+        self.count += 1
+        if self.count < self.window_size:
+            return None
+
+        self._transform(self.values[self.position:(self.position + self.window_size)])
+
+        latency = time.perf_counter() - start
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+        self.n_images += 1
+        if (self.latency_target is not None) and (latency > self.latency_target):
+            self.n_over_target += 1
+        return self.image
+
+    def mean_latency(self):
+        """Average time of the pushes that produced an image (in seconds)."""
+        return self.total_latency / self.n_images if self.n_images > 0 else None
+
+    def _transform(self, window):
+        """Write the image of window into the output buffer."""
+        windows = window[np.newaxis]
+        if self.reduced is not None:
+            windows = paa(windows, self.image_size, out=self.reduced)
+
+        # shared per-window steps: polar encoding for GAF, sorted window for MTF
+        if ('GASF' in self.trf_list) or ('GADF' in self.trf_list):
+            np.copyto(self.angles, windows)
+            minmax_scale(self.angles, feature_range=(-1, 1), axis=-1, out=self.angles)
+            np.arccos(self.angles, out=self.angles)
+            if self.phi is not self.angles:
+                np.copyto(self.phi, self.angles)
+        if ('MTF' in self.trf_list) or ('MTF_new' in self.trf_list):
+            np.copyto(self.sorted_window, windows)
+            self.sorted_window.sort(axis=-1)
+            binned = quantile_bins(windows, self.num_bin, sorted_windows=self.sorted_window, out=self.binned)
+
+        for trf, target in zip(self.trf_list, self.channels):
+            if trf == 'GASF':
+                gaf_chunk(self.phi, target, 'summation', standardize_out=self.standardize_out['GASF'], work=self.gaf_work)
+            elif trf == 'GADF':
+                gaf_chunk(self.phi, target, 'difference', standardize_out=self.standardize_out['GADF'], work=self.gaf_work)
+            elif trf == 'RP':
+                np.copyto(self.rp_window, windows)
+                rp_windows_chunk(self.rp_window, target, standardize_out=self.standardize_out['RP'], work=self.rp_work, diff=self.rp_diff)
+            elif trf == 'MTF':
+                mtf_chunk(binned, target, self.num_bin, work=self.mtf_work, rows=self.mtf_rows)
+            else:
+                mtf_new_chunk(binned, target, self.num_bin)
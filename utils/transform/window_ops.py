@@ -0,0 +1,215 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Sliding windows over a series (no copy)
+def sliding_windows(serie, window_size):
+    """Return all sliding windows of a series as a read-only 2D view (one window per row).
+
+    Parameters
+    ------------------------
+        serie : list or numpy array
+            input time series
+
+        window_size : int
+            size of the windows
+
+    Returns
+    ------------------------
+        windows : np.array of shape (len(serie) - window_size + 1, window_size)
+            view of the windows of the input series (no copy is made for float64 arrays)
+    """
+    serie = np.asarray(serie, dtype=np.float64).reshape(-1)
+    return sliding_window_view(serie, window_size)
+
+
+# Piecewise Aggregate Approximation of windows
+def paa(windows, image_size=None, out=None):
+    """Piecewise Aggregate Approximation of each window (row): the window is split into image_size equal segments
+    and each segment is replaced by its mean. If the window length is not a multiple of image_size, values on the
+    border of two segments count in both with the fraction of them falling into each.
+    The weighted sums are accumulated elementwise (not by matrix product), so a window gives the same result
+    whatever other windows it is computed with.
+
+    Parameters
+    ------------------------
+        windows : 2D numpy array
+            one window per row
+
+        image_size : int (default = None)
+            number of segments (length of the reduced windows), if not defined or the window length the windows are returned
+
+        out : 2D numpy array (default = None)
+            array of shape (n_windows, image_size) to write the result into
+
+    Returns
+    ------------------------
+        reduced : 2D numpy array of shape (n_windows, image_size)
+            mean of each segment of each window
+    """
+    window_size = windows.shape[-1]
+    if (image_size == None) or (image_size == window_size):
+        return(windows)
+    if not 1 <= image_size <= window_size:
+        raise Exception('image_size should be between 1 and the window size.')
+
+    positions, weights = paa_segments(window_size, image_size)
+    reduced = np.multiply(windows[:, positions[:, 0]], weights[:, 0], out=out)
+    for k in range(1, positions.shape[1]):
+        reduced += windows[:, positions[:, k]] * weights[:, k]
+    return(reduced)
+
+
+def paa_segments(window_size, image_size):
+    """Positions of the values in each PAA segment and their weights, both of shape (image_size, max values per segment)
+    (unused slots have weight 0). Value j covers [j * image_size, (j + 1) * image_size) and segment i covers
+    [i * window_size, (i + 1) * window_size) on a common scale, the weight is their overlap divided by window_size."""
+    first = (np.arange(image_size) * window_size) // image_size
+    last = ((np.arange(image_size) + 1) * window_size - 1) // image_size
+    positions = first[:, np.newaxis] + np.arange((last - first).max() + 1)
+
+    i = np.arange(image_size)[:, np.newaxis]
+    overlap = np.minimum((positions + 1) * image_size, (i + 1) * window_size) - np.maximum(positions * image_size, i * window_size)
+    weights = np.where(positions <= last[:, np.newaxis], np.maximum(overlap, 0), 0) / window_size
+    return(np.minimum(positions, window_size - 1), weights)
+
+
+# Min-Max scaling along one axis (same arithmetic as sklearn's MinMaxScaler)
+def minmax_scale(x, feature_range=(0, 1), axis=-1, out=None, data_min=None, data_max=None):
+    """Min-Max scale x along axis, clipped to feature_range.
+    Follows the arithmetic of sklearn.preprocessing.MinMaxScaler (x * scale + min), so that the
+    results are the same as fitting a new scaler on every slice along the axis.
+
+    Parameters
+    ------------------------
+        x : np.array
+            input array
+
+        feature_range : tuple (default = (0, 1))
+            desired range of the scaled data
+
+        axis : int (default = -1)
+            axis along which the minimum and maximum are taken
+            (e.g. axis = -2 on a stack of matrices is the column-wise scaling of MinMaxScaler)
+
+        out : np.array (default = None)
+            array to write the result into, can be x itself
+
+        data_min, data_max : np.array (default = None)
+            minimum and maximum of x along axis (with keepdims), if already known (e.g. from sorted windows)
+
+    Returns
+    ------------------------
+        out : np.array
+            scaled array (same shape as x)
+    """
+    if data_min is None:
+        data_min = np.min(x, axis=axis, keepdims=True)
+    else:
+        data_min = np.array(data_min, dtype=x.dtype)
+    if data_max is None:
+        data_max = np.max(x, axis=axis, keepdims=True)
+    data_range = np.asarray(data_max, dtype=x.dtype) - data_min
+
+    # constant slices are not scaled (see sklearn's _handle_zeros_in_scale)
+    data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.
+    scale = (feature_range[1] - feature_range[0]) / data_range
+    data_min *= scale
+    shift = feature_range[0] - data_min
+
+    out = np.multiply(x, scale, out=out)
+    out += shift
+
+    # Fixing floating point inaccuracy
+    np.clip(out, feature_range[0], feature_range[1], out=out)
+    return(out)
+
+
+# Output precision of the images
+def work_dtype(dtype):
+    """Floating point type to compute images in for a given output dtype (float64 only for float64 output, float32 otherwise)."""
+    check_image_dtype(dtype)
+    return np.float64 if np.dtype(dtype) == np.float64 else np.float32
+
+
+def check_image_dtype(dtype):
+    """Raise an exception if dtype is not a supported image output type (float64, float32, float16, uint8)."""
+    if np.dtype(dtype) not in (np.float64, np.float32, np.float16, np.uint8):
+        raise Exception('Image dtype should be float64, float32, float16 or uint8.')
+
+
+def to_image_dtype(images, dtype, value_range, out=None):
+    """Convert images (float64 or float32) to the output dtype.
+    uint8 images are quantized linearly over value_range: images ~ quantized * scale + offset.
+    The input array may be overwritten.
+
+    Parameters
+    ------------------------
+        images : np.array
+            images to convert
+
+        dtype : numpy dtype
+            float64, float32, float16 or uint8
+
+        value_range : tuple of floats
+            (min, max) of the possible image values, used for uint8 only
+
+        out : np.array (default = None)
+            array of type dtype to write the result into (can be images itself)
+
+    Returns
+    ------------------------
+        images : np.array
+            images in dtype (for uint8 a tuple of (quantized images, scale, offset))
+    """
+    dtype = np.dtype(dtype)
+    check_image_dtype(dtype)
+    if dtype != np.uint8:
+        if out is None:
+            return(images.astype(dtype, copy=False))
+        if out is not images:
+            np.copyto(out, images, casting='unsafe')
+        return(out)
+
+    scale, offset = uint8_scale(value_range)
+    images -= offset
+    images /= scale
+    np.rint(images, out=images)
+    np.clip(images, 0, 255, out=images)
+    if out is None:
+        return(images.astype(np.uint8), scale, offset)
+    np.copyto(out, images, casting='unsafe')
+    return(out, scale, offset)
+
+
+def uint8_scale(value_range):
+    """Scale and offset of the uint8 quantization of values in value_range (values ~ quantized * scale + offset)."""
+    offset = float(value_range[0])
+    scale = (float(value_range[1]) - offset) / 255. if value_range[1] > value_range[0] else 1.
+    return(scale, offset)
+
+
+def output_array(out, shape, dtype):
+    """Array for the images of a batch transform: out if given (shape and dtype are checked), a new array otherwise."""
+    if out is None:
+        return(np.empty(shape, dtype=dtype))
+    if (tuple(out.shape) != tuple(shape)) or (out.dtype != np.dtype(dtype)):
+        raise Exception('out should be an array of shape ' + str(tuple(shape)) + ' and type ' + str(np.dtype(dtype)) + '.')
+    return(out)
+
+
+def work_buffer(target, dtype, work=None):
+    """Array to compute the images of target in: work if given (preallocated by the caller), target itself if it already
+    has the working dtype and is contiguous (not e.g. one channel of a channels-last array), otherwise a new array."""
+    if work is not None:
+        return(work)
+    if (target.dtype == np.dtype(dtype)) and target.flags.c_contiguous:
+        return(target)
+    return(np.empty(target.shape, dtype=dtype))
+
+
+def check_float_dtype(dtype):
+    """Raise an exception if dtype is not a floating point image output type (the per-window functions do not quantize)."""
+    check_image_dtype(dtype)
+    if np.dtype(dtype) == np.uint8:
+        raise Exception('uint8 images are only available from the batch functions (GASF_batch, GADF_batch, RP_batch, MTF_batch, MTF_new_batch).')
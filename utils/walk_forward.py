@@ -0,0 +1,117 @@
+import numpy as np
+
+from labelled_image_preparation import data_to_labelled_img
+
+
+class WalkForwardImages:
+    """Labelled images of one asset created once over its whole history, from which train / test periods are taken
+    as slices (views, nothing is copied or transformed again).
+    Each image is a window of the series, so the images of a period are the ones of the full history whose window
+    falls in the period. With purge, the images whose label looks ahead past the end of the period (a local_min_max
+    label uses the label_window_size // 2 following prices) are left out, which gives the same images and labels as
+    running data_to_labelled_img on the period alone (data.loc[first_date:last_date]). (Not for uint8 images with
+    unstandardized RP channels, quantized over the whole history.)
+
+    Parameters
+    -------
+        data : pandas (time) series
+            input data over the whole history (with a sorted DatetimeIndex)
+
+        column_name, label_window_size, image_window_size, image_trf_strat, **params :
+            same as in data_to_labelled_img
+
+    Attributes
+    -------
+        images, image_labels, price_at_image, label_names, labelled_pd :
+            outputs of data_to_labelled_img over the whole history
+
+        quantization : dict
+            (scale, offset) of each transformation for uint8 images, None otherwise
+
+        image_dates : pd.Index
+            date of the price each image ends at (the date labelled)
+    """
+    def __init__(self, data, column_name, label_window_size, image_window_size, image_trf_strat, **params):
+        result = data_to_labelled_img(data, column_name, label_window_size, image_window_size, image_trf_strat, **params)
+        if len(result) == 0:
+            raise Exception('No images could be created from the data.')
+
+        self.labelled_pd, self.price_at_image, self.images, self.image_labels, self.label_names = result[:5]
+        self.quantization = result[5] if len(result) > 5 else None
+
+        self.index = data.index
+        self.lookahead = int(np.max(label_window_size)/2)
+        # position of the price an image ends at, relative to the first price of its window (one more with returns)
+        self.offset = image_window_size if params.get('use_returns', False) == True else image_window_size - 1
+        self.image_dates = self.index[self.offset:(self.offset + len(self.images))]
+
+    def rows(self, first_date=None, last_date=None, purge=True):
+        """Rows of the images of the period (a slice).
+
+        Parameters
+        -------
+            first_date, last_date : str or timestamp (default = None)
+                first and last date of the period (as in data.loc[first_date:last_date]), from the start / to the end of
+                the history if not defined
+
+            purge : bool (default = True)
+                whether images whose label looks ahead past last_date should be left out
+        """
+        first, stop = self.index.slice_locs(first_date, last_date)
+        # the window of an image starts at its row; its label is at row + offset and looks lookahead prices ahead
+        last_labelled = stop - 1 - self.lookahead if purge else stop - 1
+        return slice(first, min(max(last_labelled - self.offset + 1, first), len(self.images)))
+
+    def split(self, first_date=None, last_date=None, purge=True):
+        """Images of the period, as views of the arrays of the whole history.
+
+        Parameters
+        -------
+            first_date, last_date, purge :
+                same as in rows
+
+        Returns
+        -----------------------------------------
+            price_at_image, images, image_labels : np.array
+                as returned by data_to_labelled_img for the period
+
+            image_dates : pd.Index
+                date each image ends at
+        """
+        rows = self.rows(first_date, last_date, purge)
+        # the labels of a list of label_window_size have a first axis of window sizes
+        return(self.price_at_image[rows], self.images[rows], self.image_labels[..., rows, :], self.image_dates[rows])
+
+    def walk_forward(self, train_ends, test_ends, train_starts=None, purge=True):
+        """Train / test splits of a walk-forward (rolling-origin) evaluation, one per (train_end, test_end) pair: the
+        train images end up to train_end, the test images end after train_end and up to test_end (their windows
+        reach back into the train period).
+
+        Parameters
+        -------
+            train_ends, test_ends : list of str or timestamps
+                last date of each train and test period
+
+            train_starts : list of str or timestamps (default = None)
+                first date of each train period (rolling windows), the start of the history if not defined (expanding)
+
+            purge : bool (default = True)
+                whether images whose label looks ahead past the end of their period should be left out
+
+        Returns
+        -----------------------------------------
+            splits : list of (train, test) tuples
+                train and test are split() outputs
+        """
+        train_starts = [None] * len(train_ends) if train_starts is None else list(train_starts)
+        if not (len(train_starts) == len(train_ends) == len(test_ends)):
+            raise Exception('Please provide the same number of train and test periods.')
+
+        splits = []
+        for train_start, train_end, test_end in zip(train_starts, train_ends, test_ends):
+            train = self.split(train_start, train_end, purge)
+            # test windows start so that the first test image ends at the first date after train_end
+            test_first = max(self.index.slice_locs(None, train_end)[1] - self.offset, 0)
+            test = self.split(self.index[test_first], test_end, purge)
+            splits.append((train, test))
+        return splits